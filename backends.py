@@ -0,0 +1,174 @@
+# coding: utf-8
+
+"""Where the Jupiter mixer sends its output.
+
+A backend is opened with the mixer and asks it for blocks of frames with
+`mixer.mix(frame_count)`. PyAudioBackend plays them in the sound card;
+NullBackend and FileBackend have no clock of their own, the blocks are
+pulled with `run`, as fast as the mixer can go, so the engine can be
+benchmarked or tested without a sound card.
+
+Backends that can record give each block of input to the `push` of a
+record.Recorder, from their audio thread.
+"""
+
+import os
+import wave
+
+import numpy
+
+
+class Backend(object):
+    def __init__(self):
+        self.mixer = None
+        self.recorder = None
+
+    def open(self, mixer):
+        self.mixer = mixer
+
+    def close(self):
+        self.stop_recording()
+        self.mixer = None
+
+    def start_recording(self, recorder):
+        raise NotImplementedError(
+            u'{} can not record'.format(type(self).__name__))
+
+    def stop_recording(self):
+        self.recorder = None
+
+
+class PyAudioBackend(Backend):
+    u"""Play the mixer in a PyAudio stream running in callback mode."""
+
+    def __init__(self):
+        Backend.__init__(self)
+        self.audio = None
+        self.stream = None
+        self.input = None
+
+    def open(self, mixer):
+        import pyaudio
+
+        Backend.open(self, mixer)
+
+        def callback(in_data, frame_count, time_info, status):
+            profile = mixer.profile
+            if profile is not None and status & pyaudio.paOutputUnderflow:
+                profile.record_underrun()
+            return mixer.mix(frame_count).tobytes(), pyaudio.paContinue
+
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(
+            format=pyaudio.paInt16,
+            channels=mixer.channels,
+            rate=mixer.rate,
+            frames_per_buffer=mixer.period,
+            output=True,
+            stream_callback=callback
+        )
+        self.stream.start_stream()
+
+    def start_recording(self, recorder):
+        u"""Open an input stream, besides the output one, for `recorder`."""
+        import pyaudio
+
+        def callback(in_data, frame_count, time_info, status):
+            recorder.push(
+                numpy.frombuffer(in_data, numpy.int16).reshape(
+                    -1, recorder.channels),
+                self.mixer.frame if self.mixer.playing else None
+            )
+            return None, pyaudio.paContinue
+
+        self.recorder = recorder
+        self.input = self.audio.open(
+            format=pyaudio.paInt16,
+            channels=recorder.channels,
+            rate=recorder.rate,
+            frames_per_buffer=self.mixer.period,
+            input=True,
+            stream_callback=callback
+        )
+        recorder.latency = (
+            self.input.get_input_latency() + self.stream.get_output_latency())
+        self.input.start_stream()
+
+    def stop_recording(self):
+        if self.input is not None:
+            self.input.stop_stream()
+            self.input.close()
+            self.input = None
+        Backend.stop_recording(self)
+
+    def close(self):
+        self.stop_recording()
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.audio is not None:
+            self.audio.terminate()
+            self.audio = None
+        Backend.close(self)
+
+
+class NullBackend(Backend):
+    u"""Mix and throw the output away.
+
+    It records silence, a period of it for each period mixed.
+    """
+
+    def start_recording(self, recorder):
+        self.recorder = recorder
+
+    def run(self, frames):
+        u"""Pull `frames` frames from the mixer, period by period."""
+        period = self.mixer.period
+        for _ in range(0, frames, period):
+            self.write(self.mixer.mix(period))
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.push(
+                    numpy.zeros((period, recorder.channels), numpy.int16),
+                    self.mixer.frame if self.mixer.playing else None
+                )
+
+    def write(self, block):
+        pass
+
+
+class FileBackend(NullBackend):
+    u"""Write the output to a 16 bit WAV file."""
+
+    def __init__(self, path):
+        NullBackend.__init__(self)
+        self.path = path
+        self.output = None
+
+    def open(self, mixer):
+        NullBackend.open(self, mixer)
+        self.output = wave.open(self.path, u'wb')
+        self.output.setnchannels(mixer.channels)
+        self.output.setsampwidth(2)
+        self.output.setframerate(mixer.rate)
+
+    def write(self, block):
+        self.output.writeframes(block.tobytes())
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+        NullBackend.close(self)
+
+
+BACKENDS = {
+    'pyaudio': PyAudioBackend,
+    'null': NullBackend,
+}
+
+
+def default_backend():
+    u"""The backend named in JUPITER_BACKEND, PyAudio if not set."""
+    return BACKENDS[os.environ.get('JUPITER_BACKEND', 'pyaudio')]()
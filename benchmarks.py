@@ -0,0 +1,354 @@
+# coding: utf-8
+
+"""Jupiter benchmarks.
+
+Run with `python benchmarks.py [--quick] [--output results.json]`. Nothing
+here needs Tk or a sound card; the sounds are synthetic WAVs written to a
+temporary directory. The results are written as json, to be compared
+between releases.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import struct
+import tempfile
+import timeit
+import wave
+
+import numpy
+
+from backends import NullBackend
+from engine import Clip, Mixer, Pattern, fragments_index
+from sound import JupiterSound, Peaks
+
+CHUNK_SIZE = 255
+
+# the old loader is quadratic, bigger files would take minutes
+LEGACY_LOAD_MAX_SECONDS = 30
+# the same as MAX_WAVEFORM_COLUMNS of jupiter.py, that needs Tk
+WAVEFORM_COLUMNS = 2000
+# the old seek reads everything before the seek point
+LEGACY_SEEK_MAX_SECONDS = 60
+
+
+def legacy_scale(data, volume):
+    u"""The old JupiterSound.play loop: scale and repack one chunk."""
+    data = numpy.frombuffer(data, numpy.int16) * volume
+    # struct refuses floats on python3, so the samples are truncated
+    # before being unpacked as arguments, as python2 did implicitly
+    return struct.pack('h' * len(data), *data.astype(numpy.int16))
+
+
+def legacy_get_data(media):
+    u"""The old JupiterSound.get_data: concatenate 255 frames at a time."""
+    data = media.readframes(CHUNK_SIZE)
+    _d = data
+    while _d:
+        _d = media.readframes(CHUNK_SIZE)
+        data += _d
+    return numpy.frombuffer(data, numpy.int16)
+
+
+def legacy_seek(path, seconds):
+    u"""The old JupiterSound.play(seek): read and discard until `seek`."""
+    media = wave.open(path, u'rb')
+    media.readframes(int(media.getframerate() * seconds))
+    media.close()
+
+
+def legacy_active(fragments, seconds):
+    u"""The old update_play_line loop: look at every fragment."""
+    return [
+        f for f in fragments
+        if f.start <= seconds < f.start + f.sound.duration
+    ]
+
+
+class FakeSound(object):
+    def __init__(self, data, channels=1, framerate=44100):
+        self.data = data
+        self.channels = channels
+        self.framerate = framerate
+        self.max_value = 32767
+
+    @property
+    def frames(self):
+        return self.data.reshape(-1, self.channels)
+
+    @property
+    def duration(self):
+        return len(self.frames) / float(self.framerate)
+
+    @property
+    def peaks(self):
+        return Peaks.from_frames(self.frames, self.max_value)
+
+
+def noise(frames, channels=1):
+    return numpy.random.randint(
+        -32768, 32767, frames * channels).astype(numpy.int16)
+
+
+def write_wav(path, seconds, channels=2, rate=44100):
+    output = wave.open(path, u'wb')
+    output.setnchannels(channels)
+    output.setsampwidth(2)
+    output.setframerate(rate)
+    # written by parts to not need the whole file in memory
+    for _ in range(int(seconds)):
+        output.writeframes(noise(rate, channels).tobytes())
+    output.close()
+
+
+def best_time(func, repeat=3, number=1):
+    u"""Seconds of the fastest of `repeat` runs of `func`."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def frames_per_second(func, frames, repeat=3):
+    return frames / best_time(func, repeat)
+
+
+def bench_volume_scaling(frames=44100 * 10):
+    u"""Frames per second of the old per-chunk loop against the mixer."""
+    raw = noise(frames).tobytes()
+    chunk_bytes = CHUNK_SIZE * 2
+
+    def legacy():
+        for i in range(0, len(raw), chunk_bytes):
+            legacy_scale(raw[i:i + chunk_bytes], 0.5)
+
+    fragment = Clip(FakeSound(noise(frames)), volume=0.5)
+    mixer = Mixer([fragment], channels=1)
+    backend = NullBackend()
+    mixer.open(backend)
+
+    def vectorized():
+        mixer.play_from(0.0)
+        backend.run(frames)
+
+    return {
+        'legacy': frames_per_second(legacy, frames),
+        'vectorized': frames_per_second(vectorized, frames),
+    }
+
+
+def bench_wav_load(durations=(10, 30, 120, 600)):
+    u"""Seconds to load stereo WAVs of each duration (in seconds)."""
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for seconds in durations:
+            path = os.path.join(directory, u'{}.wav'.format(seconds))
+            write_wav(path, seconds)
+            result = {
+                'seconds': seconds,
+                'megabytes': os.path.getsize(path) / (1024.0 * 1024.0),
+                'load': best_time(lambda: JupiterSound(path, mapped=False)),
+                'mapped': best_time(lambda: JupiterSound(path, mapped=True)),
+            }
+            if seconds <= LEGACY_LOAD_MAX_SECONDS:
+                result['legacy'] = best_time(
+                    lambda: legacy_get_data(wave.open(path, u'rb')), 1)
+            results.append(result)
+            os.remove(path)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def bench_waveform(durations=(10, 60, 600), columns=WAVEFORM_COLUMNS):
+    u"""Seconds to compute the peaks of stereo sounds and draw columns."""
+    results = []
+    for seconds in durations:
+        sound = FakeSound(noise(44100 * seconds, 2), channels=2)
+        peaks = sound.peaks
+        results.append({
+            'seconds': seconds,
+            'samples': sound.data.size,
+            'peaks': best_time(lambda: sound.peaks),
+            'columns': best_time(lambda: peaks.columns(columns), number=10),
+        })
+    return results
+
+
+def bench_mix(counts=(1, 8, 32, 128), seconds=5):
+    u"""Frames mixed per second with `counts` fragments sounding at once."""
+    frames = 44100 * seconds
+    results = []
+    for count in counts:
+        sound = FakeSound(noise(frames, 2), channels=2)
+        # a few frames apart, so all of them are playing together
+        fragments = [
+            Clip(sound, start=i * 0.001, volume=0.5) for i in range(count)
+        ]
+        mixer = Mixer(fragments)
+        backend = NullBackend()
+        mixer.open(backend)
+
+        def run():
+            mixer.play_from(0.0)
+            backend.run(frames)
+
+        results.append({
+            'fragments': count,
+            'frames_per_second': frames_per_second(run, frames),
+        })
+        mixer.close()
+    return results
+
+
+def bench_lookup(sizes=(100, 1000, 10000, 100000), queries=1000):
+    u"""Seconds of each lookup of active fragments, by project size.
+
+    The fragments are 0.1 second hits, 8 per second of timeline, like a
+    dense drum track; `with_stem` adds a stem as long as the timeline.
+    """
+    results = []
+    sound = FakeSound(numpy.zeros(4410, numpy.int16))
+    for size in sizes:
+        fragments = [Clip(sound, start=i / 8.0) for i in range(size)]
+        index = fragments_index(fragments)
+        with_stem = fragments_index(fragments)
+        with_stem.add(object(), 0.0, size / 8.0)
+        moments = numpy.random.uniform(0, size / 8.0, queries)
+        legacy_queries = max(1, min(queries, 10000000 // (size * 100)))
+
+        def indexed():
+            for t in moments:
+                index.active_at(t)
+
+        def indexed_with_stem():
+            for t in moments:
+                with_stem.active_at(t)
+
+        def legacy():
+            for t in moments[:legacy_queries]:
+                legacy_active(fragments, t)
+
+        results.append({
+            'fragments': size,
+            'indexed': best_time(indexed) / queries,
+            'with_stem': best_time(indexed_with_stem) / queries,
+            'legacy': best_time(legacy) / legacy_queries,
+        })
+    return results
+
+
+def bench_patterns(bars=300, hits_per_bar=16, seconds=60):
+    u"""Frames mixed per second of a drum track, with and without patterns."""
+    sound = FakeSound(noise(4410, 2), channels=2)
+    bar_seconds = 2.0
+    bar = [
+        Clip(sound, start=i * bar_seconds / hits_per_bar)
+        for i in range(hits_per_bar)
+    ]
+    pattern = Pattern(bar, length=bar_seconds)
+    tracks = {
+        'hits': [
+            Clip(sound, start=(b * bar_seconds) + clip.start)
+            for b in range(bars) for clip in bar
+        ],
+        'patterns': [
+            Clip(pattern, start=b * bar_seconds) for b in range(bars)
+        ],
+    }
+    frames = 44100 * seconds
+    result = {'bars': bars, 'hits_per_bar': hits_per_bar}
+    for name, fragments in tracks.items():
+        mixer = Mixer(fragments)
+        backend = NullBackend()
+        mixer.open(backend)
+
+        def run():
+            mixer.play_from(0.0)
+            backend.run(frames)
+
+        result[name] = frames_per_second(run, frames, repeat=1)
+        mixer.close()
+    return result
+
+
+def bench_seek(positions=(0, 60, 600, 2400), rate=44100, channels=2):
+    u"""Seconds to start playing a long stem at each position (in seconds).
+
+    The stem is a sparse file mapped as the pool maps WAVs, so it takes
+    no room on disk nor in memory.
+    """
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        path = os.path.join(directory, u'stem.raw')
+        frames = (max(positions) + 60) * rate
+        with open(path, 'wb') as f:
+            f.truncate(frames * channels * 2)
+        data = numpy.memmap(path, numpy.int16, u'r')
+        mixer = Mixer([Clip(FakeSound(data, channels))], rate=rate,
+                      channels=channels)
+        backend = NullBackend()
+        mixer.open(backend)
+        legacy_path = os.path.join(directory, u'legacy.wav')
+        write_wav(legacy_path, LEGACY_SEEK_MAX_SECONDS, channels, rate)
+        for seconds in positions:
+            def seek():
+                mixer.play_from(seconds)
+                backend.run(mixer.period)
+
+            result = {'seconds': seconds, 'seek': best_time(seek, number=10)}
+            if seconds <= LEGACY_SEEK_MAX_SECONDS:
+                result['legacy'] = best_time(
+                    lambda: legacy_seek(legacy_path, seconds))
+            results.append(result)
+        mixer.close()
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+QUICK = {
+    'wav_load': {'durations': (1, 10)},
+    'waveform': {'durations': (1, 10)},
+    'mix': {'counts': (1, 8), 'seconds': 1},
+    'lookup': {'sizes': (100, 1000), 'queries': 100},
+    'patterns': {'bars': 10, 'seconds': 10},
+    'seek': {'positions': (0, 60, 600)},
+}
+
+
+def run_all(quick=False):
+    options = QUICK if quick else {}
+    return {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'machine': platform.machine(),
+        'volume_scaling': bench_volume_scaling(
+            44100 if quick else 44100 * 10),
+        'wav_load': bench_wav_load(**options.get('wav_load', {})),
+        'waveform': bench_waveform(**options.get('waveform', {})),
+        'mix': bench_mix(**options.get('mix', {})),
+        'lookup': bench_lookup(**options.get('lookup', {})),
+        'patterns': bench_patterns(**options.get('patterns', {})),
+        'seek': bench_seek(**options.get('seek', {})),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=u'Jupiter benchmarks.')
+    parser.add_argument(
+        '--quick', action='store_true', help=u'small sizes, for CI')
+    parser.add_argument(
+        '--output', help=u'json file to write, default to stdout')
+    args = parser.parse_args()
+    results = run_all(args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,668 @@
+# coding: utf-8
+
+"""Jupiter audio engine.
+
+All the sound fragments are mixed by a single `Mixer` into one output
+stream, instead of opening one stream (and one thread) per sound.
+"""
+
+import collections
+import math
+import threading
+import time
+import uuid
+
+import numpy
+
+from sound import Peaks
+from timeline import IntervalIndex
+
+INT16_MIN = -32768
+INT16_MAX = 32767
+# levels below this are shown as silence
+METER_FLOOR_DB = -60.0
+# mixed periods kept for the meters until they are read, ~0.7s at 512
+METER_RING_PERIODS = 64
+# shapes of fades, see fade_curve
+FADE_CURVES = ('linear', 'equal_power')
+
+
+def fade_curve(x, curve='linear'):
+    u"""Gain along a fade in, `x` going from 0 to 1."""
+    if curve == 'equal_power':
+        return numpy.sin(x * (numpy.pi / 2))
+    return x
+
+
+class Edit(object):
+    u"""Non-destructive changes of how a fragment plays its sound.
+
+    Only the parameters are kept. The sound is trimmed by slicing its
+    frames (a view, never a copy) and the fades and gain are applied to
+    each block while mixing. Times are in seconds of the sound; a
+    `source_out` of None is the end of the sound.
+    """
+
+    FIELDS = (
+        'source_in', 'source_out', 'fade_in', 'fade_out', 'fade_curve',
+        'gain_db',
+    )
+
+    def __init__(self, source_in=0.0, source_out=None, fade_in=0.0,
+                 fade_out=0.0, fade_curve='linear', gain_db=0.0):
+        if fade_curve not in FADE_CURVES:
+            raise ValueError(u'Unknown fade curve: {}'.format(fade_curve))
+        self.source_in = source_in
+        self.source_out = source_out
+        self.fade_in = fade_in
+        self.fade_out = fade_out
+        self.fade_curve = fade_curve
+        self.gain_db = gain_db
+
+    def __eq__(self, other):
+        return isinstance(other, Edit) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def copy(self):
+        return Edit(**self.to_dict())
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in Edit.FIELDS)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**dict(
+            (name, data[name]) for name in Edit.FIELDS if name in data))
+
+    @property
+    def gain(self):
+        return 10 ** (self.gain_db / 20.0)
+
+    def source_end(self, sound):
+        u"""Where the trimmed sound ends, in seconds of `sound`."""
+        if self.source_out is None:
+            return sound.duration
+        return min(self.source_out, sound.duration)
+
+    def bounds(self, sound):
+        u"""(first, last) frames of `sound` that are played."""
+        first = max(0, int(round(self.source_in * sound.framerate)))
+        last = int(round(self.source_end(sound) * sound.framerate))
+        return first, max(first, last)
+
+    def frames(self, sound):
+        u"""The trimmed frames of `sound`."""
+        first, last = self.bounds(sound)
+        return sound.frames[first:last]
+
+    def duration(self, sound):
+        return max(0.0, self.source_end(sound) - self.source_in)
+
+    def envelope(self, position, count, length, rate):
+        u"""Gain of `count` frames from `position` of the trimmed sound.
+
+        `length` is the count of trimmed frames. Returns a number when no
+        fade touches these frames, a (count, 1) float32 array otherwise.
+        """
+        fade_in = int(round(self.fade_in * rate))
+        fade_out = int(round(self.fade_out * rate))
+        if position >= fade_in and position + count <= length - fade_out:
+            return self.gain
+        index = numpy.arange(position, position + count, dtype=numpy.float32)
+        gain = numpy.full(count, self.gain, numpy.float32)
+        if fade_in > 0 and position < fade_in:
+            gain *= fade_curve(
+                numpy.clip(index / fade_in, 0, 1), self.fade_curve)
+        if fade_out > 0 and position + count > length - fade_out:
+            gain *= fade_curve(
+                numpy.clip((length - index) / fade_out, 0, 1),
+                self.fade_curve)
+        return gain[:, None]
+
+
+class Clip(object):
+    u"""A sound placed in the timeline, without any UI.
+
+    Has the same attributes of SoundFragment that the engine uses.
+    """
+
+    def __init__(self, sound, start=0.0, volume=1.0, mute=False, solo=False,
+                 edit=None):
+        self.sound = sound
+        # the moment when the sound starts
+        self.start = start
+        self.volume = volume
+        self.mute = mute
+        self.solo = solo
+        self.edit = edit or Edit()
+
+    @property
+    def frames(self):
+        return self.edit.frames(self.sound)
+
+    @property
+    def duration(self):
+        return self.edit.duration(self.sound)
+
+
+def fragments_index(fragments):
+    u"""Build an IntervalIndex, in seconds, of `fragments`."""
+    index = IntervalIndex()
+    for fragment in fragments:
+        index.add(fragment, fragment.start, fragment.start + fragment.duration)
+    return index
+
+
+def audible_clips(clips):
+    u"""Drop the clips silenced by mute or by the solo of other clips."""
+    solo = any(c.solo for c in clips)
+    return [c for c in clips if not c.mute and (c.solo or not solo)]
+
+
+def mix_block(block, block_start, index, rate, scratch):
+    u"""Sum into `block` the clips of `index` sounding in it.
+
+    `block_start` is the frame of timeline where `block` begins and
+    `scratch` a buffer at least as long as `block`.
+    """
+    block_end = block_start + len(block)
+    # one frame of margin because of the rounding to frames
+    candidates = index.overlapping(
+        (block_start - 1) / float(rate), (block_end + 1) / float(rate))
+    for clip in candidates:
+        start = int(round(clip.start * rate))
+        frames = clip.frames
+        lo = max(block_start, start)
+        hi = min(block_end, start + len(frames))
+        if lo >= hi:
+            continue
+        gain = clip.volume * sound_gain(clip.sound)
+        gain = gain * clip.edit.envelope(
+            lo - start, hi - lo, len(frames), rate)
+        add_frames(
+            block[lo - block_start:], frames[lo - start:hi - start],
+            gain, scratch
+        )
+
+
+class Pattern(object):
+    u"""Clips grouped to be placed many times, but mixed only once.
+
+    An instance of the pattern is a fragment (or Clip) with the pattern
+    as its sound: the mixer plays the pre-rendered `frames` as if they
+    were one sound, so a bar repeated 300 times costs 300 buffer adds,
+    not all of its hits summed again each time. Changing the clips or
+    the volume renders it again right away, never in the audio thread,
+    and every instance plays the new one.
+
+    The clips start at their `start` from the beginning of the pattern,
+    which lasts `length` seconds (until the end of the last clip if
+    None).
+
+    Patterns can be clips of other patterns (their `parents`), which are
+    rendered again when the ones inside them are. Who uses a pattern (an
+    instance, or a clip of another pattern) calls `acquire` and later
+    `release`, like with a SamplePool.
+    """
+
+    key = None
+    mapped = False
+    path = None
+    max_value = INT16_MAX
+
+    def __init__(self, clips, rate=44100, channels=2, length=None,
+                 volume=1.0):
+        # identifies the pattern in project files
+        self.id = uuid.uuid4().hex
+        self.clips = list(clips)
+        self.framerate = rate
+        self.channels = channels
+        self.length = length
+        self.__volume = volume
+        # the patterns with this one in their clips
+        self.parents = set()
+        # instances and clips using the pattern, see acquire
+        self.users = 0
+        for clip in self.clips:
+            if isinstance(clip.sound, Pattern):
+                clip.sound.acquire()
+                clip.sound.parents.add(self)
+        self.render()
+
+    @property
+    def volume(self):
+        return self.__volume
+
+    @volume.setter
+    def volume(self, value):
+        self.__volume = value
+        self.update()
+
+    @property
+    def frames(self):
+        return self.data
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    @property
+    def peaks(self):
+        if self._peaks is None:
+            self._peaks = Peaks.from_frames(self.data, self.max_value)
+        return self._peaks
+
+    def acquire(self):
+        self.users += 1
+
+    def release(self, pool):
+        u"""Tell a user is gone; the last one releases the clip sounds.
+
+        The sounds of the clips are released from `pool` and the patterns
+        inside this one are released too.
+        """
+        self.users -= 1
+        if self.users > 0:
+            return
+        for clip in self.clips:
+            if isinstance(clip.sound, Pattern):
+                clip.sound.parents.discard(self)
+                clip.sound.release(pool)
+            elif clip.sound.key is not None:
+                pool.release(clip.sound)
+
+    def ancestors(self):
+        u"""The patterns with this one inside, the inner ones first."""
+        order = []
+        seen = set()
+
+        def visit(pattern):
+            for parent in pattern.parents:
+                if parent not in seen:
+                    seen.add(parent)
+                    visit(parent)
+                    order.append(parent)
+
+        visit(self)
+        # each one was appended after the ones containing it
+        order.reverse()
+        return order
+
+    def update(self):
+        u"""Render the clips again, after some of them changed.
+
+        The patterns with this one inside are rendered again too.
+        """
+        self.render()
+        for pattern in self.ancestors():
+            pattern.render()
+
+    def render(self):
+        rate = self.framerate
+        clips = audible_clips(self.clips)
+        if self.length is None:
+            length = max([
+                int(round(c.start * rate)) + len(c.frames) for c in clips
+            ] or [0])
+        else:
+            length = int(round(self.length * rate))
+        frames = numpy.zeros((length, self.channels), numpy.float32)
+        mix_block(
+            frames, 0, fragments_index(clips), rate, numpy.zeros_like(frames))
+        frames *= self.volume
+        frames.flags.writeable = False
+        self._peaks = None
+        self.duration = length / float(rate)
+        # replaced at once, the mixer can be reading the old one
+        self.data = frames
+
+    def get_state(self):
+        u"""The pattern as the dicts of project files."""
+        clips = []
+        for clip in self.clips:
+            if isinstance(clip.sound, Pattern):
+                state = {'pattern': clip.sound.get_state()}
+            else:
+                state = {
+                    'path': clip.sound.path,
+                    'duration': clip.sound.duration,
+                }
+            state.update(
+                start=clip.start, volume=clip.volume, mute=clip.mute,
+                solo=clip.solo
+            )
+            state.update(clip.edit.to_dict())
+            clips.append(state)
+        return {
+            'id': self.id,
+            'length': self.length,
+            'volume': self.volume,
+            'clips': clips,
+        }
+
+    @classmethod
+    def from_state(cls, state, load_sound, rate=44100, channels=2,
+                   patterns=None):
+        u"""Build a pattern from its dict, see get_state.
+
+        `load_sound(path, duration)` gives the sound of each clip.
+        `patterns` maps the ids of states to the patterns already built,
+        so the instances of a pattern share it.
+        """
+        if patterns is None:
+            patterns = {}
+        if state['id'] in patterns:
+            return patterns[state['id']]
+        clips = []
+        for entry in state['clips']:
+            if 'pattern' in entry:
+                sound = cls.from_state(
+                    entry['pattern'], load_sound, rate, channels, patterns)
+            else:
+                sound = load_sound(entry['path'], entry['duration'])
+            clips.append(Clip(
+                sound,
+                start=entry.get('start', 0.0),
+                volume=entry.get('volume', 1.0),
+                mute=entry.get('mute', False),
+                solo=entry.get('solo', False),
+                edit=Edit.from_dict(entry)
+            ))
+        pattern = cls(
+            clips, rate, channels, state.get('length'),
+            state.get('volume', 1.0)
+        )
+        pattern.id = state['id']
+        patterns[state['id']] = pattern
+        return pattern
+
+
+class Voice(object):
+    u"""A fragment that is sounding right now in the mixer."""
+
+    def __init__(self, fragment, position=0, delay=0):
+        self.fragment = fragment
+        # the next frame (of fragment's sound) to be mixed
+        self.position = position
+        # frames of silence before the sound starts in the next period,
+        # this is what makes the onsets sample accurate
+        self.delay = delay
+        # set by the mixer when the position passes the last frame
+        self.finished = False
+
+    @property
+    def frames(self):
+        u"""The frames of fragment, already trimmed."""
+        return self.fragment.frames
+
+
+def add_frames(out, frames, gain, scratch):
+    u"""Sum `frames` * `gain` into `out` matching the channels of `out`.
+
+    `gain` is a number or a (frames, 1) array, to change along the frames.
+
+    `scratch` is a float32 buffer at least as long as `frames`, used to
+    scale the samples without allocating a new array every period.
+    """
+    if frames.shape[1] != out.shape[1]:
+        # mono sounds are copied to every channel, anything else is
+        # downmixed to mono first
+        frames = frames.mean(axis=1, keepdims=True)
+    count = len(frames)
+    scaled = scratch[:count, :frames.shape[1]]
+    numpy.multiply(frames, gain, out=scaled)
+    out[:count] += scaled
+    return scaled
+
+
+def block_levels(block):
+    u"""(peak, rms) of a block of int16 scaled samples, from 0 to 1."""
+    if not block.size:
+        return 0.0, 0.0
+    peak = max(float(block.max()), -float(block.min())) / -INT16_MIN
+    # a dot product doesn't allocate the squares, as square().mean() does
+    samples = block.ravel()
+    rms = math.sqrt(float(numpy.dot(samples, samples)) / samples.size)
+    return peak, rms / -INT16_MIN
+
+
+def to_db(level):
+    u"""Level (from 0 to 1) in dBFS, never below METER_FLOOR_DB."""
+    if level <= 0:
+        return METER_FLOOR_DB
+    return max(METER_FLOOR_DB, 20 * math.log10(level))
+
+
+def meter_fraction(level):
+    u"""How much of a meter `level` fills, in a dB scale."""
+    return 1.0 - (to_db(level) / METER_FLOOR_DB)
+
+
+class Levels(object):
+    u"""Peak and rms of the periods mixed since the last read.
+
+    Made by Mixer.read_levels in the thread of who reads them, never in
+    the audio thread.
+    """
+
+    SILENCE = (0.0, 0.0)
+
+    def __init__(self, master=SILENCE, fragments=None):
+        self.master = master
+        # id(fragment) -> (peak, rms)
+        self.fragments = fragments or {}
+
+    def get(self, fragment):
+        return self.fragments.get(id(fragment), Levels.SILENCE)
+
+
+def sound_gain(sound):
+    u"""Scale to bring the samples of `sound` to the int16 range."""
+    return INT16_MAX / float(sound.max_value)
+
+
+def to_int16(samples):
+    u"""Convert float samples to int16, clipping instead of wrapping."""
+    numpy.clip(samples, INT16_MIN, INT16_MAX, out=samples)
+    return samples.astype(numpy.int16)
+
+
+class Mixer(object):
+    u"""Sum every active fragment into a single output stream.
+
+    The mixer is also the transport: while `playing` it walks `frame`
+    (the position in timeline) inside the audio callback and starts each
+    fragment exactly at the frame where it begins.
+    """
+
+    def __init__(self, fragments, timeline=None, rate=44100, channels=2,
+                 period=512):
+        # ids of the fragments of session in solo, kept up to date by
+        # set_solo, so mix doesn't look at every fragment each period
+        self.solos = set(id(f) for f in fragments if f.solo)
+        # IntervalIndex of fragments (in seconds), used to find which ones
+        # must be started without looking at all of them
+        if timeline is None:
+            timeline = fragments_index(fragments)
+        self.timeline = timeline
+        self.rate = rate
+        self.channels = channels
+        self.period = period
+        self.voices = []
+        self.lock = threading.Lock()
+        self.backend = None
+        self.playing = False
+        # the next frame of timeline to be mixed
+        self.frame = 0
+        # the blocks of the last periods: the audio thread only appends
+        # them, read_levels reduces them to levels
+        self.meter_ring = collections.deque(maxlen=METER_RING_PERIODS)
+        # the levels of the last read_levels
+        self.levels = Levels()
+        # a profiling.PlaybackProfile, to measure the mixer (opt-in)
+        self.profile = None
+        # (frame, time.perf_counter()) of the last play_from
+        self._clock = (0, 0.0)
+        self._buffer = numpy.zeros((period, channels), numpy.float32)
+        self._scratch = numpy.zeros((period, channels), numpy.float32)
+
+    def open(self, backend):
+        u"""Start to send the output to `backend` (see backends.py)."""
+        self.backend = backend
+        backend.open(self)
+
+    def close(self):
+        self.stop_all()
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+
+    def set_solo(self, fragment, value):
+        u"""Tell if `fragment` of session is in solo (or left the session)."""
+        with self.lock:
+            if value:
+                self.solos.add(id(fragment))
+            else:
+                self.solos.discard(id(fragment))
+
+    def stop(self, fragment):
+        with self.lock:
+            self.voices = [v for v in self.voices if v.fragment is not fragment]
+
+    def stop_all(self):
+        with self.lock:
+            self.playing = False
+            self.voices = []
+            self.meter_ring.clear()
+            self.levels = Levels()
+
+    @property
+    def seconds(self):
+        u"""The position of transport in the timeline."""
+        return self.frame / float(self.rate)
+
+    def start_frame(self, fragment):
+        return int(round(fragment.start * self.rate))
+
+    def play_from(self, seek=0.0):
+        u"""Start the transport at `seek` seconds of timeline."""
+        frame = int(round(seek * self.rate))
+        with self.lock:
+            self.voices = []
+            # fragments that are already sounding at seek point
+            for fragment in self.timeline.active_at(seek):
+                start = self.start_frame(fragment)
+                if start < frame < start + len(fragment.frames):
+                    self.voices.append(Voice(fragment, frame - start))
+            self.frame = frame
+            self._clock = (frame, time.perf_counter())
+            self.playing = True
+
+    def schedule(self, frame_count):
+        u"""Start the fragments that begin in the next `frame_count` frames."""
+        first = self.frame
+        last = first + frame_count
+        # half a frame of margin because of the rounding to frames
+        candidates = self.timeline.starting_in(
+            (first - 0.5) / self.rate, (last + 0.5) / self.rate)
+        profile = self.profile
+        for fragment in candidates:
+            start = self.start_frame(fragment)
+            if first <= start < last:
+                self.voices.append(Voice(fragment, delay=start - first))
+                if profile is not None:
+                    profile.record_start(self.lateness(start))
+
+    def lateness(self, start):
+        u"""Seconds the frame `start`, mixed now, is after its time.
+
+        Counted from the last play_from, as if the transport walked
+        with the wall clock.
+        """
+        frame, began = self._clock
+        intended = began + (start - frame) / float(self.rate)
+        actual = time.perf_counter() + (start - self.frame) / float(self.rate)
+        return actual - intended
+
+    def read_levels(self):
+        u"""Levels of what was mixed since the last call.
+
+        The blocks published by `mix` are reduced here, in the thread of
+        the caller (e.g. the UI, at display rate). With nothing mixed
+        meanwhile the last levels are given again.
+        """
+        periods = []
+        while True:
+            try:
+                periods.append(self.meter_ring.popleft())
+            except IndexError:
+                break
+        if not periods:
+            return self.levels
+        master = numpy.concatenate([out for out, _ in periods])
+        scaled = collections.defaultdict(list)
+        for _, sounding in periods:
+            for key, frames, gain in sounding:
+                scaled[key].append((frames * gain).ravel())
+        self.levels = Levels(
+            block_levels(master.astype(numpy.float32)),
+            dict(
+                (key, block_levels(numpy.concatenate(blocks)))
+                for key, blocks in scaled.items()
+            )
+        )
+        return self.levels
+
+    def mix(self, frame_count):
+        u"""Return the next `frame_count` frames as an int16 array."""
+        profile = self.profile
+        if profile is not None:
+            began = time.perf_counter()
+        if len(self._buffer) < frame_count:
+            self._buffer = numpy.zeros(
+                (frame_count, self.channels), numpy.float32)
+            self._scratch = numpy.zeros_like(self._buffer)
+        out = self._buffer[:frame_count]
+        out.fill(0)
+        with self.lock:
+            if self.playing:
+                self.schedule(frame_count)
+                self.frame += frame_count
+            voices = list(self.voices)
+        solo = bool(self.solos)
+        # (id(fragment), frames, gain) of what was heard, for the meters
+        sounding = []
+
+        for voice in voices:
+            fragment = voice.fragment
+            delay, voice.delay = voice.delay, 0
+            count = frame_count - delay
+            position = voice.position
+            # read once, the edit can be changed by the UI meanwhile
+            trimmed = voice.frames
+            frames = trimmed[position:position + count]
+            voice.position += count
+            voice.finished = voice.position >= len(trimmed)
+            if fragment.mute or (solo and not fragment.solo):
+                # muted fragments keep walking, so unmute them
+                # sounds in the right place
+                continue
+            gain = fragment.volume * sound_gain(fragment.sound)
+            gain = gain * fragment.edit.envelope(
+                position, len(frames), len(trimmed), self.rate)
+            add_frames(out[delay:], frames, gain, self._scratch)
+            # the frames are a view of the sound, nothing is copied
+            sounding.append((id(fragment), frames, gain))
+
+        with self.lock:
+            self.voices = [v for v in self.voices if not v.finished]
+
+        out = to_int16(out)
+        # a new array each period, so it can be kept as it is
+        self.meter_ring.append((out, sounding))
+        if profile is not None:
+            profile.record_callback(
+                time.perf_counter() - began, frame_count / float(self.rate))
+        return out
@@ -0,0 +1,135 @@
+# coding: utf-8
+
+"""Undo and redo of the changes made in the arrangement.
+
+Every change is a Command that knows how to undo and redo itself. Only
+the values that changed are kept (never audio), and at most `depth`
+commands are remembered.
+"""
+
+import collections
+import os
+
+# how many commands can be undone
+HISTORY_DEPTH = int(os.environ.get('JUPITER_HISTORY_DEPTH', 200))
+
+
+class Command(object):
+    u"""Something done in the arrangement that can be undone."""
+
+    # the objects changed, so who undoes can update them
+    targets = ()
+
+    def undo(self):
+        raise NotImplementedError
+
+    def redo(self):
+        raise NotImplementedError
+
+    def discard(self):
+        u"""Called when the command leaves the history for good."""
+
+
+class SetAttributes(Command):
+    u"""A change of attributes of one or many objects, as a single step.
+
+    `changes` are (target, name, old, new); the ones with old == new are
+    dropped. Undone in the reverse order they are given.
+    """
+
+    def __init__(self, changes):
+        self.changes = [c for c in changes if c[2] != c[3]]
+
+    def __len__(self):
+        return len(self.changes)
+
+    @property
+    def targets(self):
+        seen = collections.OrderedDict()
+        for target, _, _, _ in self.changes:
+            seen[id(target)] = target
+        return list(seen.values())
+
+    def undo(self):
+        for target, name, old, _ in reversed(self.changes):
+            setattr(target, name, old)
+
+    def redo(self):
+        for target, name, _, new in self.changes:
+            setattr(target, name, new)
+
+
+class Batch(Command):
+    u"""Several commands done, undone and redone as a single step."""
+
+    def __init__(self, commands):
+        self.commands = list(commands)
+
+    @property
+    def targets(self):
+        return [t for command in self.commands for t in command.targets]
+
+    def undo(self):
+        for command in reversed(self.commands):
+            command.undo()
+
+    def redo(self):
+        for command in self.commands:
+            command.redo()
+
+    def discard(self):
+        for command in self.commands:
+            command.discard()
+
+
+
+class History(object):
+    u"""The commands done and undone, the oldest dropped past `depth`."""
+
+    def __init__(self, depth=HISTORY_DEPTH):
+        self.depth = depth
+        self.done = collections.deque()
+        self.undone = []
+
+    def push(self, command):
+        u"""Remember `command`, that was just done."""
+        self.done.append(command)
+        # a new change can't be followed by the ones undone before it
+        while self.undone:
+            self.undone.pop().discard()
+        while len(self.done) > self.depth:
+            self.done.popleft().discard()
+
+    def do(self, command):
+        command.redo()
+        self.push(command)
+
+    def undo(self):
+        u"""Undo the last command and return it, None if there is none."""
+        if not self.done:
+            return None
+        command = self.done.pop()
+        command.undo()
+        self.undone.append(command)
+        return command
+
+    def redo(self):
+        if not self.undone:
+            return None
+        command = self.undone.pop()
+        command.redo()
+        self.done.append(command)
+        return command
+
+    def refers_to(self, target):
+        u"""If some command done or undone changes `target`."""
+        return any(
+            target in command.targets
+            for command in list(self.done) + self.undone
+        )
+
+    def clear(self):
+        while self.done:
+            self.done.pop().discard()
+        while self.undone:
+            self.undone.pop().discard()
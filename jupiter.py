@@ -2,39 +2,107 @@
 
 """Jupiter audio sequencer."""
 
+import collections
+import math
 import os
-import uuid
 import time
-import threading
-import audioop
-import math
-import struct
+import uuid
 import wave
 
 import numpy
-import pyaudio
 from boring import draw
 from boring.window import SubWindow, Window, import_tkinter, import_filedialog
 from boring.widgets import Label, ExtendedCanvas as Canvas, Button, Entry
 from boring.dialog import DefaultDialog
 
+from backends import default_backend
+from engine import (
+    Clip, Edit, Levels, Mixer, Pattern, meter_fraction, to_db
+)
+from history import Batch, Command, History, SetAttributes
+from profiling import PlaybackProfile
+from record import Recorder
+from project import EXTENSION, Project, load_project, save_project
+from sound import (
+    LOAD_ERRORS, POOL, SESSION_CHANNELS, SESSION_RATE, LoadCancelled,
+    SoundLoader, SoundPlaceholder
+)
+from timeline import IntervalIndex
+
 
-PYAUDIO = pyaudio.PyAudio()
 tk = import_tkinter()
 filedialog = import_filedialog()
 
 
-def lerp(a, b, x):
-    u"""Linear Interpolation."""
-    return a + ((b - a) * x)
+def acquire_sound(sound):
+    u"""One more fragment uses `sound`, released when it is deleted."""
+    if isinstance(sound, Pattern):
+        sound.acquire()
+    elif sound.key is not None:
+        POOL.retain(sound)
+
+
+def release_sound(sound):
+    if isinstance(sound, Pattern):
+        sound.release(POOL)
+    else:
+        POOL.release(sound)
 
 
 SELECT_COLOR = u'#1e90ff'
 SELECT_MARK_PADDING_PX = 15
 SELECT_LINE_WIDTH = 3
 
+# limits the points of the waveform line of very wide fragments
+MAX_WAVEFORM_COLUMNS = 2000
+
+# handles in the sides of fragments, to trim them (or fade with shift)
+TRIM_HANDLE_WIDTH_PX = 6
+TRIM_HANDLE_COLOR = u'#999'
+# narrower fragments have no handles, they would cover all of it
+MIN_TRIM_HANDLES_WIDTH_PX = 3 * TRIM_HANDLE_WIDTH_PX
+# fragments can't be trimmed shorter than this
+MIN_TRIM_SECONDS = 0.01
+FADE_LINE_COLOR = u'#fff'
+
 TRACK_LABEL_FONT = ('TkDefaultFont', 8)
 
+METER_COLOR = u'#2ecc71'
+# width of the level meter of fragments and length of the master one
+METER_WIDTH = 4
+MASTER_METER_LENGTH = 100
+
+# how often the play line follows the transport (~40 fps)
+PLAY_LINE_INTERVAL_MS = 25
+# the parts of a beat that the BPMGrid can show, finest first
+GRID_SUBDIVISIONS = (0.25, 0.5, 1, 4)
+BEATS_PER_BAR = 4
+# grid lines closer than this are not shown
+MIN_GRID_SPACING_PX = 8
+
+# redraws are done at most once in this interval (~60 fps)
+FRAME_MS = 16
+# how often the sounds loaded in background are checked
+LOADER_POLL_MS = 50
+# steps of volume of the +/- keys
+VOLUME_STEP = 0.1
+# where the recordings are written
+RECORDINGS_DIR = os.environ.get(
+    'JUPITER_RECORDINGS',
+    os.path.join(os.path.expanduser('~'), 'jupiter-recordings')
+)
+RECORD_CHANNELS = 1
+# how often the fragment being recorded is redrawn
+RECORD_POLL_MS = 100
+# file where the playback profile is written; when set in the environment
+# the profiling starts enabled
+PROFILE_PATH = os.environ.get('JUPITER_PROFILE', u'')
+DEFAULT_PROFILE_PATH = u'jupiter-profile.json'
+
+PROJECT_FILETYPES = (
+    ('Jupiter Projects', '*' + EXTENSION),
+)
+
 # fixme > read pallete from configuration file
 COLORS = [
     '#00aacc', '#CD1B00', '#00CD74', '#CD8900', '#CD0066'
@@ -108,6 +176,30 @@ class ChangeBPMDialog(DefaultDialog):
         self.result = self._entry.get()
 
 
+class ClipGainDialog(DefaultDialog):
+    def __init__(self, *args, **kwargs):
+        self.gain_db = kwargs.pop('gain_db', 0.0)
+        kwargs.update(button_class=DefaultDialogButton)
+        DefaultDialog.__init__(self, *args, **kwargs)
+
+    def body(self, parent):
+        self._entry = Entry(
+            parent,
+            fg='#333',
+            text='Gain (dB)',
+            relief='flat',
+            bd=10,
+            insertwidth=1
+        )
+        self._entry.grid(pady=5, padx=5)
+        self._entry.delete(0, 'end')
+        self._entry.insert('0', str(self.gain_db))
+        return self._entry
+
+    def apply(self):
+        self.result = self._entry.get()
+
+
 class JupiterAboutWindow(SubWindow):
     def __init__(self, *args, **kwargs):
         SubWindow.__init__(self, *args, **kwargs)
@@ -178,17 +270,63 @@ class ToggleCanvasButton(CanvasButton):
         self.update_colors()
 
 
+class RedrawScheduler(object):
+    u"""Collect what must be redrawn and draw it once per frame.
+
+    `request` a function (usually a bound `redraw` method) as many times
+    as wanted, it will be called once in the next frame.
+    """
+
+    def __init__(self, widget, interval_ms=FRAME_MS):
+        self.widget = widget
+        self.interval_ms = interval_ms
+        self.dirty = collections.OrderedDict()
+        self.scheduled = False
+
+    def request(self, func):
+        self.dirty[func] = True
+        if not self.scheduled:
+            self.scheduled = True
+            self.widget.after(self.interval_ms, self.flush)
+
+    def flush(self):
+        try:
+            # what is requested while flushing is drawn in this same frame
+            while self.dirty:
+                func, _ = self.dirty.popitem(last=False)
+                func()
+        finally:
+            self.scheduled = False
+            # a redraw raised: the others are drawn in the next frame
+            if self.dirty:
+                self.scheduled = True
+                self.widget.after(self.interval_ms, self.flush)
+
+
 class BPMGrid(object):
+    u"""Vertical lines of bars, beats and parts of beats.
+
+    The canvas lines are kept and just moved when the bpm, zoom or scroll
+    change, and only the lines inside the canvas are drawn. The finer
+    levels are hidden when zooming out, so lines are never closer than
+    MIN_GRID_SPACING_PX.
+    """
+
     def __init__(self, canvas, sec_px, start_px, bpm, **kwargs):
         self.fill = kwargs.pop('fill', '#444')
+        self.bar_fill = kwargs.pop('bar_fill', '#666')
+        self.subdivision_fill = kwargs.pop('subdivision_fill', '#3a3a3a')
         self.tag = uuid.uuid4().hex
         self.canvas = canvas
         self.visible = kwargs.pop('visible', True)
+        # canvas lines already created and the (fill, dash) of each one
+        self.lines = []
+        self.line_styles = []
 
         self.start_px = start_px
         self.__sec_px = sec_px
         self.__bpm = bpm
-        self.px_distance = int(self.sec_px / (self.bpm / 60.0))
+        self.update_px_distance()
         self.label = draw.TextDraw(
             self.canvas,
             20, self.canvas.winfo_height() - 60,
@@ -200,7 +338,8 @@ class BPMGrid(object):
         self.draw()
 
     def update_px_distance(self):
-        self.px_distance = int(self.sec_px / (self.bpm / 60.0))
+        # pixels between two beats
+        self.px_distance = self.sec_px / (self.bpm / 60.0)
 
     @property
     def bpm(self):
@@ -224,102 +363,90 @@ class BPMGrid(object):
         self.update_px_distance()
         self.draw()
 
-    def draw(self):
-        self.canvas.delete(self.tag)
-        if not self.visible:
-            return
-
-        for x in xrange(
-                self.start_px, self.canvas.winfo_width(), self.px_distance):
-            if x < 0:
-                continue
-            self.canvas.create_line(
-                x, 0, x, self.canvas.winfo_height(),
-                fill=self.fill,
-                tags=self.tag,
-                dash=(15,),
-            )
-
-
-class JupiterSound(object):
-    CHUNK_SIZE = 255
-
-    def __init__(self, path):
-        self.path = path
-        self.media = wave.open(self.path, u'rb')
-        self.data = self.get_data()
-        self.duration = self.media.getnframes() / float(
-            self.media.getframerate())
-        self.playing = False
-        self.volume = 1.0
-        self.decibel = 0
-
-    def get_data(self):
-        data = self.media.readframes(JupiterSound.CHUNK_SIZE)
-        _d = data
-        while _d:
-            _d = self.media.readframes(JupiterSound.CHUNK_SIZE)
-            data += _d
-        return numpy.fromstring(data, 'Int16')
-
-    def play(self, seek=0.0):
-        if self.playing:
-            return
-
-
-        self.media.rewind()
-        self.playing = True
-
-        stream = PYAUDIO.open(
-            format=PYAUDIO.get_format_from_width(self.media.getsampwidth()),
-            channels=self.media.getnchannels(),
-            rate=self.media.getframerate(),
-            output=True
-        )
+    def get_step(self):
+        u"""The beats between two lines at the current zoom."""
+        for step in GRID_SUBDIVISIONS:
+            if self.px_distance * step >= MIN_GRID_SPACING_PX:
+                return step
+        # not even bars fit, so only some of the bars are shown
+        step = BEATS_PER_BAR
+        while self.px_distance * step < MIN_GRID_SPACING_PX:
+            step *= 2
+        return step
+
+    def get_style(self, beat):
+        if beat % BEATS_PER_BAR == 0:
+            return self.bar_fill, ()
+        if beat % 1 == 0:
+            return self.fill, (15,)
+        return self.subdivision_fill, (2, 6)
 
-        def callback():
-            # reading some first bytes to conform 'seek'
-            self.media.readframes(int(self.media.getframerate() * seek))
-
-            data = self.media.readframes(JupiterSound.CHUNK_SIZE)
-            while self.playing and data:
-                data = numpy.fromstring(data, 'Int16') * self.volume
-                # python3 error
-                data = struct.pack('h' * len(data), *data)
-
-                stream.write(data)
-                data = self.media.readframes(JupiterSound.CHUNK_SIZE)
-                self.decibel = 20 * math.log10(audioop.rms(data, 2))
-            stream.stop_stream()
-            stream.close()
-            self.playing = False
-
-        threading.Thread(target=callback).start()
-
-    def stop(self):
-        self.playing = False
-
-    def __del__(self):
-        self.stop()
+    def draw(self):
+        count = 0
+        if self.visible and self.px_distance > 0:
+            step = self.get_step()
+            step_px = self.px_distance * step
+            height = self.canvas.winfo_height()
+            # nothing is drawn before the start line
+            first = max(0, int(math.ceil(-self.start_px / step_px)))
+            last = int((self.canvas.winfo_width() - self.start_px) / step_px)
+            for index in range(first, last + 1):
+                x = self.start_px + (index * step_px)
+                self.place_line(count, x, height, self.get_style(index * step))
+                count += 1
+
+        # the lines not needed now stay hidden until next draws
+        for index in range(count, len(self.lines)):
+            if self.line_styles[index] is not None:
+                self.canvas.itemconfigure(self.lines[index], state='hidden')
+                self.line_styles[index] = None
+
+    def place_line(self, index, x, height, style):
+        if index == len(self.lines):
+            self.lines.append(self.canvas.create_line(
+                x, 0, x, height, tags=self.tag))
+            self.line_styles.append(None)
+        line = self.lines[index]
+        self.canvas.coords(line, x, 0, x, height)
+        if self.line_styles[index] != style:
+            fill, dash = style
+            self.canvas.itemconfigure(
+                line, fill=fill, dash=dash, state='normal')
+            self.line_styles[index] = style
 
 
 class SoundFragment(draw.RectangleDraw):
-    MAX_Y_VALUE = 32767.0
-
     def __init__(self, main_window, jupiter_sound, start, y, **kwargs):
-        # the moment when the sound starts
-        self.start = start
-
         self.main_window = main_window
         _fill = kwargs.pop('fill', COLORS[0])
         self.sound = jupiter_sound
+        # trims, fades and gain, applied by the mixer while playing
+        self.__edit = kwargs.pop('edit', None) or Edit()
+        # (start, y, edit) when the mouse was pressed, see remember_state
+        self.pressed_state = None
+        # in the timeline index (so heard and shown), see detach; only
+        # at the end of __init__, the mixer must never see it half built
+        self.attached = False
+        # the canvas items were deleted for good
+        self.deleted = False
+        # the moment when the sound starts
+        self.start = start
         self.__volume = kwargs.pop('volume', 1.0)
 
-        self.mute = kwargs.pop('mute', False)
-        self.solo = kwargs.pop('solo', False)
+        _mute = kwargs.pop('mute', False)
+        _solo = kwargs.pop('solo', False)
         self.button_width = kwargs.pop('button_width', 25)
         self.button_height = kwargs.pop('button_height', 25)
         self.__selected = False
+        # fragments out of the window have their items hidden and
+        # are not updated, see MainJupiterWindow.update_viewport
+        self.in_viewport = True
+        # the sec_px used by the last calculates_sound_lines
+        self.sound_lines_sec_px = None
+        # what was drawn in last redraw, to change only what is different
+        self._drawn_fill = None
+        self._drawn_geometry = None
+        self._drawn_selection = None
 
         draw.RectangleDraw.__init__(
             self, main_window.main_canvas, self.get_x(), y,
@@ -330,6 +457,8 @@ class SoundFragment(draw.RectangleDraw):
         )
 
         self.bind('<1>', self.mark_as_selected, '+')
+        self.bind('<1>', self.remember_state, '+')
+        self.bind('<ButtonRelease-1>', self.record_state, '+')
 
         self.mute_btn = ToggleCanvasButton(
             self.canvas,
@@ -349,6 +478,10 @@ class SoundFragment(draw.RectangleDraw):
             text=u'S',
             fill=self.fill
         )
+        self.solo_btn.bind('<1>', self.solo_changed, '+')
+        self.solo_btn.text.bind('<1>', self.solo_changed, '+')
+        self.mute = _mute
+        self.solo = _solo
         self.fill_btn = draw.RectangleDraw(
             self.canvas,
             self.x + (self.button_width * 2),
@@ -366,7 +499,7 @@ class SoundFragment(draw.RectangleDraw):
             self.button_height,
             fill=self.fill,
             outline=self.fill,
-            text=str(self.volume),
+            text=u'{:.1f}'.format(self.volume),
             font=('TkDefaultFont', 6)
         )
         self.track_label = draw.TextDraw(
@@ -383,7 +516,7 @@ class SoundFragment(draw.RectangleDraw):
             self.canvas,
             self.get_sound_line_points(),
             fill='#000',
-            width=3
+            width=1
         ).bind('<1>', self.mark_as_selected, '+')
 
         self.selected_mark = draw.RectangleDraw(
@@ -394,15 +527,85 @@ class SoundFragment(draw.RectangleDraw):
             width=SELECT_LINE_WIDTH,
             dash=(5, )
         )
+        # level of sound while playing, grows up from the bottom
+        self.meter = draw.RectangleDraw(
+            self.canvas,
+            0, 0, 0, 0,
+            fill=METER_COLOR,
+            outline=''
+        )
+        self.meter_height = 0
+        # shape of the fades, over the waveform
+        self.fade_line = draw.LineDraw(
+            self.canvas,
+            [0, 0, 0, 0],
+            fill=FADE_LINE_COLOR,
+            width=1
+        )
+        self.trim_in_handle = draw.RectangleDraw(
+            self.canvas,
+            0, 0, 0, 0,
+            fill=TRIM_HANDLE_COLOR,
+            outline=''
+        ).bind('<B1-Motion>', self.trim_in_handler, '+')
+        self.trim_in_handle.bind('<1>', self.remember_state, '+')
+        self.trim_in_handle.bind('<ButtonRelease-1>', self.record_state, '+')
+        self.trim_out_handle = draw.RectangleDraw(
+            self.canvas,
+            0, 0, 0, 0,
+            fill=TRIM_HANDLE_COLOR,
+            outline=''
+        ).bind('<B1-Motion>', self.trim_out_handler, '+')
+        self.trim_out_handle.bind('<1>', self.remember_state, '+')
+        self.trim_out_handle.bind('<ButtonRelease-1>', self.record_state, '+')
 
         self.update_component()
         self.enable_drag()
+        self.attached = True
+        self.reindex()
+        self.solo_changed()
+
+    def get_draws(self):
+        u"""All the canvas draws of this fragment."""
+        return [
+            self, self.sound_line, self.track_label, self.selected_mark,
+            self.meter, self.volume_btn, self.volume_btn.text,
+            self.mute_btn, self.mute_btn.text,
+            self.solo_btn, self.solo_btn.text,
+            self.fill_btn, self.fade_line,
+            self.trim_in_handle, self.trim_out_handle,
+        ]
+
+    def set_in_viewport(self, value):
+        if value == self.in_viewport:
+            return
+        self.in_viewport = value
+        state = 'normal' if value else 'hidden'
+        for item in self.get_draws():
+            item.configure(state=state)
+        if value:
+            # right now, to not show it where it was when hidden; all of
+            # it, the handles of narrow fragments must be hidden again
+            self._drawn_geometry = None
+            self.redraw()
+
+    def intersects_rows(self, top, bottom):
+        u"""If some part of fragment is between y `top` and `bottom`."""
+        first = self.y - self.button_height - SELECT_MARK_PADDING_PX
+        last = self.y + self.height + SELECT_MARK_PADDING_PX
+        return first < bottom and last > top
 
     def delete(self):
+        self.detach()
+        self.deleted = True
         draw.RectangleDraw.delete(self)
         self.sound_line.delete()
         self.track_label.delete()
         self.selected_mark.delete()
+        self.meter.delete()
+        self.fade_line.delete()
+        self.trim_in_handle.delete()
+        self.trim_out_handle.delete()
         self.volume_btn.delete()
         self.mute_btn.delete()
         self.fill_btn.delete()
@@ -427,7 +630,75 @@ class SoundFragment(draw.RectangleDraw):
         return self.main_window.start_line_left_padding + pad_left
 
     def get_width(self):
-        return int(self.sound.duration * self.main_window.sec_px)
+        return int(self.duration * self.main_window.sec_px)
+
+    @property
+    def frames(self):
+        u"""The frames of sound that are played, after the trims."""
+        return self.edit.frames(self.sound)
+
+    @property
+    def duration(self):
+        return self.edit.duration(self.sound)
+
+    @property
+    def start(self):
+        return self.__start
+
+    @start.setter
+    def start(self, value):
+        self.__start = value
+        self.reindex()
+
+    def reindex(self):
+        u"""Keep the timeline index of main window in sync."""
+        # detached fragments must not come back to the session, e.g. when
+        # the sound of a deleted (but undoable) one finishes loading
+        if self.attached:
+            self.main_window.timeline.move(self, self.start, self.end)
+
+    def detach(self):
+        u"""Take it out of the timeline index, so it isn't heard nor shown."""
+        self.attached = False
+        if self in self.main_window.timeline:
+            self.main_window.timeline.remove(self)
+        self.main_window.mixer.set_solo(self, False)
+        self.stop()
+
+    def attach(self):
+        self.attached = True
+        self.reindex()
+        self.solo_changed()
+        # the sound can have changed (loaded, rendered) while detached
+        self.edit_changed()
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    @property
+    def mute(self):
+        return self.mute_btn.selected
+
+    @mute.setter
+    def mute(self, value):
+        self.mute_btn.selected = value
+        self.mute_btn.update_colors()
+
+    @property
+    def solo(self):
+        return self.solo_btn.selected
+
+    @solo.setter
+    def solo(self, value):
+        self.solo_btn.selected = value
+        self.solo_btn.update_colors()
+        self.solo_changed()
+
+    def solo_changed(self, event=None):
+        u"""Tell the mixer, that keeps the fragments in solo."""
+        if self.attached:
+            self.main_window.mixer.set_solo(self, self.solo)
 
     @property
     def volume(self):
@@ -436,6 +707,49 @@ class SoundFragment(draw.RectangleDraw):
     @volume.setter
     def volume(self, value):
         self.__volume = value
+        self.volume_btn.text.text = u'{:.1f}'.format(value)
+
+    @property
+    def edit(self):
+        return self.__edit
+
+    @edit.setter
+    def edit(self, value):
+        # a copy, the handles change the edit in place and the one given
+        # may be kept in history
+        self.__edit = value.copy()
+        # the end can change
+        self.reindex()
+        self.edit_changed()
+
+    def get_state(self):
+        u"""What is saved of this fragment in a project."""
+        if isinstance(self.sound, Pattern):
+            state = {'pattern': self.sound.get_state()}
+        else:
+            state = {
+                'path': self.sound.path,
+                'duration': self.sound.duration,
+            }
+        state.update({
+            'start': self.start,
+            'y': self.y,
+            'volume': self.volume,
+            'mute': self.mute,
+            'solo': self.solo,
+            'fill': self.fill,
+            'track_label': self.track_label.text,
+        })
+        state.update(self.edit.to_dict())
+        return state
+
+    def set_sound(self, sound):
+        u"""Change the sound, e.g. when the real one of a placeholder is loaded."""
+        self.sound = sound
+        # the real duration can differ a bit from the saved one
+        self.reindex()
+        self.calculates_sound_lines()
+        self.update_component()
 
     def rotate_color(self, event=None):
         index = COLORS.index(self.fill)
@@ -446,65 +760,117 @@ class SoundFragment(draw.RectangleDraw):
         self.update_component()
 
     def update_component(self, dx=None, dy=None):
-        self.fill_btn.configure(fill=self.fill, outline=self.fill)
-        self.configure(outline=self.fill, stipple='gray12')
-        self.width = self.get_width()
-
-        # recalculating position
-        self.x = self.get_x()
-
-        self.mute_btn.original_fill = self.fill
-        self.solo_btn.original_fill = self.fill
-        self.volume_btn.configure(fill=self.fill, outline=self.fill)
-
-        if self.selected:
-            self.selected_mark.configure(width=SELECT_LINE_WIDTH)
-            self.selected_mark.xy = self.x - SELECT_MARK_PADDING_PX, self.y - self.button_height - SELECT_MARK_PADDING_PX
-            self.selected_mark.width = self.width + (SELECT_MARK_PADDING_PX * 2)
-            self.selected_mark.height = self.height + (SELECT_MARK_PADDING_PX * 2) + self.button_height
-        else:
-            self.selected_mark.configure(width=0)
-            self.selected_mark.xy = 0, 0
-            self.selected_mark.size = 0, 0
-
-        self.track_label.x = self.x + (self.button_width * 4) + 5
-        self.track_label.y = self.y - (self.button_height / 2)
+        u"""Redraw the fragment in the next frame."""
+        self.main_window.redraw_scheduler.request(self.redraw)
 
-        self.mute_btn.xy = self.x, self.y - self.button_height
-        self.solo_btn.xy = (
-            self.x + self.button_width, self.y - self.button_height
-        )
-        self.fill_btn.xy = (
-            self.x + (self.button_width * 2), self.y - self.button_height
-        )
-        self.volume_btn.xy = (
-            self.x + (self.button_width * 3), self.y - self.button_height
+    def redraw(self):
+        if self.deleted or not self.in_viewport:
+            # updated when it comes back to the window
+            return
+        if self.sound_lines_sec_px != self.main_window.sec_px:
+            self.calculates_sound_lines()
+
+        if self.fill != self._drawn_fill:
+            self.fill_btn.configure(fill=self.fill, outline=self.fill)
+            self.configure(outline=self.fill, stipple='gray12')
+            self.mute_btn.original_fill = self.fill
+            self.solo_btn.original_fill = self.fill
+            self.volume_btn.configure(fill=self.fill, outline=self.fill)
+            self._drawn_fill = self.fill
+
+        geometry = (
+            self.get_x(), self.y, self.get_width(),
+            self.edit.fade_in, self.edit.fade_out
         )
-        self.sound_line.coords = self.get_sound_line_points()
-        self.canvas.update_idletasks()
+        if geometry != self._drawn_geometry:
+            # recalculating position
+            self.width = self.get_width()
+            self.x = self.get_x()
+
+            self.track_label.x = self.x + (self.button_width * 4) + 5
+            self.track_label.y = self.y - (self.button_height / 2)
+
+            self.mute_btn.xy = self.x, self.y - self.button_height
+            self.solo_btn.xy = (
+                self.x + self.button_width, self.y - self.button_height
+            )
+            self.fill_btn.xy = (
+                self.x + (self.button_width * 2), self.y - self.button_height
+            )
+            self.volume_btn.xy = (
+                self.x + (self.button_width * 3), self.y - self.button_height
+            )
+            self.sound_line.coords = self.get_sound_line_points()
+            self.place_meter()
+            self.place_edit_draws()
+            self._drawn_geometry = geometry
+
+        selection = (self.selected, geometry)
+        if selection != self._drawn_selection:
+            if self.selected:
+                self.selected_mark.configure(width=SELECT_LINE_WIDTH)
+                self.selected_mark.xy = self.x - SELECT_MARK_PADDING_PX, self.y - self.button_height - SELECT_MARK_PADDING_PX
+                self.selected_mark.width = self.width + (SELECT_MARK_PADDING_PX * 2)
+                self.selected_mark.height = self.height + (SELECT_MARK_PADDING_PX * 2) + self.button_height
+            else:
+                self.selected_mark.configure(width=0)
+                self.selected_mark.xy = 0, 0
+                self.selected_mark.size = 0, 0
+            self._drawn_selection = selection
+
+    def set_meter(self, level):
+        u"""Show `level` (the peak, from 0 to 1) in the meter."""
+        height = int(meter_fraction(level) * self.height)
+        if height != self.meter_height:
+            self.meter_height = height
+            self.place_meter()
+
+    def place_meter(self):
+        self.meter.xy = self.x, self.y + self.height - self.meter_height
+        self.meter.size = METER_WIDTH, self.meter_height
+
+    def place_edit_draws(self):
+        u"""Move the trim handles and the fade line to the fragment."""
+        self.trim_in_handle.xy = self.x, self.y
+        self.trim_out_handle.xy = (
+            self.x + self.width - TRIM_HANDLE_WIDTH_PX, self.y)
+        # else a click in a short hit would trim it instead of selecting
+        wide = self.width >= MIN_TRIM_HANDLES_WIDTH_PX
+        state = 'normal' if wide else 'hidden'
+        for handle in (self.trim_in_handle, self.trim_out_handle):
+            handle.size = TRIM_HANDLE_WIDTH_PX, self.height
+            handle.configure(state=state)
+        sec_px = self.main_window.sec_px
+        fade_in = min(self.width, self.edit.fade_in * sec_px)
+        fade_out = min(self.width - fade_in, self.edit.fade_out * sec_px)
+        bottom = self.y + self.height
+        self.fade_line.coords = [
+            self.x, bottom, self.x + fade_in, self.y,
+            self.x + self.width - fade_out, self.y, self.x + self.width, bottom
+        ]
 
     def get_sound_line_points(self):
-        points = []
-        for i in range(0, len(self.sound_line_points), 2):
-            points.extend([
-                self.sound_line_points[i] + self.x,
-                self.sound_line_points[i + 1] + self.y
-            ])
-        return points
+        return (self.sound_line_points + (self.x, self.y)).ravel().tolist()
 
     def calculates_sound_lines(self):
-        u"""Cache the points of sound line."""
-        width = int(self.sound.duration * self.main_window.sec_px)
-        points = []
-        samples = 400
-        y_offset = self.height / 2.0
-        for s in range(samples):
-            lerp_x = s / float(samples)
-            x = lerp(0, width, lerp_x)
-            sample_index = int(lerp(0, len(self.sound.data), lerp_x))
-            y = ((self.sound.data[sample_index] * self.height) / SoundFragment.MAX_Y_VALUE) + y_offset
-            points.extend([x, y])
-        self.sound_line_points = points
+        u"""Cache the points of sound line.
+
+        The line goes up and down between the max and the min of
+        each column of the waveform.
+        """
+        width = self.get_width()
+        columns = max(1, min(width, MAX_WAVEFORM_COLUMNS))
+        first, last = self.edit.bounds(self.sound)
+        peaks = self.sound.peaks.columns(columns, first, last)
+        half_height = self.height / 2.0
+        x = numpy.linspace(0, width, columns)
+        top = half_height - (peaks[:, 1] * half_height)
+        bottom = half_height - (peaks[:, 0] * half_height)
+        self.sound_line_points = numpy.column_stack(
+            [x, top, x, bottom]).reshape(-1, 2)
+        self.sound_lines_sec_px = self.main_window.sec_px
+        # the new line must be drawn
+        self._drawn_geometry = None
 
     def drag_handler(self, event):
         draw.RectangleDraw.drag_handler(self, event)
@@ -514,11 +880,138 @@ class SoundFragment(draw.RectangleDraw):
         self.start = distance / self.main_window.sec_px
         self.update_component(dx, dy)
 
-    def play(self, seek=0.0):
-        self.sound.play(seek)
+    def seconds_at(self, x):
+        u"""Seconds from the start of fragment to canvas `x`."""
+        padding = self.main_window.start_line_left_padding
+        return (x - padding) / float(self.main_window.sec_px) - self.start
+
+    def trim_in_handler(self, event):
+        u"""Drag of the left handle: trim the start, or fade in with shift."""
+        edit = self.edit
+        seconds = self.seconds_at(event.x)
+        if self.main_window.kmap.get('Shift_L', False):
+            edit.fade_in = max(
+                0.0, min(seconds, self.duration - edit.fade_out))
+        else:
+            source_in = max(0.0, min(
+                edit.source_in + seconds,
+                edit.source_end(self.sound) - MIN_TRIM_SECONDS
+            ))
+            moved = source_in - edit.source_in
+            edit.source_in = source_in
+            # the sound stays where it was in the timeline
+            self.start += moved
+        self.edit_changed()
+
+    def trim_out_handler(self, event):
+        u"""Drag of the right handle: trim the end, or fade out with shift."""
+        edit = self.edit
+        seconds = self.seconds_at(event.x)
+        if self.main_window.kmap.get('Shift_L', False):
+            edit.fade_out = max(
+                0.0, min(self.duration - seconds, self.duration - edit.fade_in))
+        else:
+            edit.source_out = max(
+                edit.source_in + MIN_TRIM_SECONDS,
+                min(edit.source_in + seconds, self.sound.duration)
+            )
+            # the end changed
+            self.reindex()
+        self.edit_changed()
+
+    def remember_state(self, event=None):
+        self.pressed_state = (self.start, self.y, self.edit.copy())
+
+    def record_state(self, event=None):
+        u"""Put what a drag (of fragment or of a handle) did in history."""
+        if self.pressed_state is None:
+            return
+        start, y, edit = self.pressed_state
+        self.pressed_state = None
+        command = SetAttributes([
+            (self, 'edit', edit, self.edit.copy()),
+            (self, 'start', start, self.start),
+            (self, 'y', y, self.y),
+        ])
+        if command:
+            self.main_window.history.push(command)
+
+    def edit_changed(self):
+        u"""Show a new edit; the mixer reads it in the next period."""
+        self.calculates_sound_lines()
+        self.update_component()
+
+    def copy(self, start):
+        u"""A new fragment like this one (sharing its sound) at `start`."""
+        acquire_sound(self.sound)
+        return SoundFragment(
+            self.main_window, self.sound, start, self.y,
+            volume=self.volume,
+            mute=self.mute,
+            solo=self.solo,
+            fill=self.fill,
+            track_label=self.track_label.text,
+            edit=self.edit.copy()
+        )
 
     def stop(self):
-        self.sound.stop()
+        self.main_window.mixer.stop(self)
+
+
+class RemoveFragments(Command):
+    u"""Deletion of fragments that can be undone.
+
+    The fragments are only hidden and taken out of the session; they are
+    really deleted when the command leaves the history.
+    """
+
+    def __init__(self, window, fragments):
+        self.window = window
+        self.targets = list(fragments)
+        self.removed = False
+
+    def undo(self):
+        self.window.attach_fragments(self.targets)
+        self.removed = False
+
+    def redo(self):
+        self.window.detach_fragments(self.targets)
+        self.removed = True
+
+    def discard(self):
+        if self.removed:
+            for fragment in self.targets:
+                fragment.delete()
+                release_sound(fragment.sound)
+
+
+class AddFragments(Command):
+    u"""Creation of fragments (already added to the session) that can be
+    undone.
+
+    Undoing only hides them; they are deleted when the command leaves
+    the history undone.
+    """
+
+    def __init__(self, window, fragments):
+        self.window = window
+        self.targets = list(fragments)
+        self.removed = False
+
+    def undo(self):
+        self.window.detach_fragments(self.targets)
+        self.removed = True
+
+    def redo(self):
+        if self.removed:
+            self.window.attach_fragments(self.targets)
+            self.removed = False
+
+    def discard(self):
+        if self.removed:
+            for fragment in self.targets:
+                fragment.delete()
+                release_sound(fragment.sound)
 
 
 class MainJupiterWindow(Window):
@@ -539,7 +1032,14 @@ class MainJupiterWindow(Window):
             bg=self['bg'])
         self.main_canvas.pack(expand='yes', fill='both')
         self.main_canvas.update_idletasks()
+        # the fragments and the grid are drawn through this
+        self.redraw_scheduler = RedrawScheduler(self)
         self.bind('<o>', self.open_file, '+')
+        self.bind('<Control-o>', self.open_project, '+')
+        self.bind('<Control-s>', self.save_project, '+')
+        self.bind('<c>', self.cancel_loading, '+')
+        self.bind('<p>', self.toggle_profiling, '+')
+        self.bind('<r>', self.toggle_recording, '+')
         self.bind('<Button-4>', self.mouse_scroll_up_handler, '+')
         self.bind('<Button-5>', self.mouse_scroll_down_handler, '+')
 
@@ -574,12 +1074,45 @@ class MainJupiterWindow(Window):
             anchor='sw', fill='#999',
             font=('TkDefaultFont', 10, 'bold')
         )
+        # measures of playback, only shown while profiling
+        self.profile_label = draw.TextDraw(
+            self.main_canvas,
+            160,
+            self.height - 20,
+            text=u'',
+            anchor='sw', fill='#999',
+            font=('TkDefaultFont', 8)
+        )
+        self.master_meter = draw.RectangleDraw(
+            self.main_canvas,
+            20, self.height - 90, 0, 6,
+            fill=METER_COLOR, outline=''
+        )
+        self.master_meter_label = draw.TextDraw(
+            self.main_canvas,
+            20 + MASTER_METER_LENGTH + 10,
+            self.height - 84,
+            text=u'', anchor='w', fill='#999',
+            font=('TkDefaultFont', 8)
+        )
 
         self.main_canvas.create_text(
             self.width - 20,
             20, text=u'\n\n'.join([
                 'o - open wav',
+                'ctrl+o - open project',
+                'ctrl+s - save project',
+                'c - cancel loading of sounds',
+                'p - profile playback',
+                'r - record at cursor',
                 'b - change bpm',
+                'g - change gain of selected',
+                '+/- - change volume of selected',
+                'ctrl+g - make a pattern of selected',
+                'ctrl+d - clone selected after them',
+                'ctrl+ +/- - change volume of selected patterns',
+                'ctrl+z/ctrl+y - undo/redo',
+                'drag sides - trim (shift: fade)',
                 't - about',
                 'a - select all',
                 'f2 - rename sound',
@@ -621,8 +1154,6 @@ class MainJupiterWindow(Window):
         )
 
         self.playing = False
-        # the point in time that start to play (time of computer)
-        self.start_play = None
         # the point in timeline that start to play (time of music)
         self.start_seek = None
 
@@ -634,13 +1165,40 @@ class MainJupiterWindow(Window):
         self.bind('<a>', self.select_all_sound_fragments, '+')
         self.bind('<F2>', self.rename_selected_sound_fragment, '+')
         self.bind('<b>', self.change_bpm, '+')
+        self.bind('<g>', self.change_clip_gain, '+')
+        self.bind('<plus>', self.increase_volume, '+')
+        self.bind('<minus>', self.decrease_volume, '+')
+        self.bind('<Control-plus>', self.increase_pattern_volume, '+')
+        self.bind('<Control-minus>', self.decrease_pattern_volume, '+')
+        self.bind('<Control-g>', self.group_fragments, '+')
+        self.bind('<Control-d>', self.clone_fragments, '+')
+        self.bind('<Control-z>', self.undo, '+')
+        self.bind('<Control-y>', self.redo, '+')
         self.bind('<t>', self.show_about, '+')
         self.bind('<Home>', self.set_cursor_to_start_position, '+')
         self.bind('<End>', self.set_cursor_to_end_position, '+')
 
         self.sounds = []
+        # self.sounds sorted by time, updated by SoundFragment.start
+        self.timeline = IntervalIndex()
+        # the fragments inside the window
+        self.visible_sounds = set()
         self.main_canvas.focus_force()
 
+        # every fragment is played through this single output stream
+        self.mixer = Mixer(
+            self.sounds, self.timeline,
+            rate=SESSION_RATE, channels=SESSION_CHANNELS
+        )
+        self.mixer.open(default_backend())
+        if PROFILE_PATH:
+            self.toggle_profiling()
+        self.loader = SoundLoader()
+        self.history = History()
+        self.recorder = None
+        # the fragment of the sound being recorded
+        self.recording_fragment = None
+
         self.__bpm = 110
         self.bpm_grid = BPMGrid(
             self.main_canvas,
@@ -664,13 +1222,9 @@ class MainJupiterWindow(Window):
         ]
 
     def set_cursor_to_end_position(self, event=None):
-        if len(self.sounds) == 0:
+        seek = self.timeline.end
+        if seek is None:
             return
-        seek = self.sounds[0].start + self.sounds[0].sound.duration
-        for sound in self.sounds[1:]:
-            sound_seek = sound.start + sound.sound.duration
-            if sound_seek > seek:
-                seek = sound_seek
         x = self.start_line_left_padding + (self.sec_px * seek)
         if x > self.width:
             # the cursor will be in the end of canvas/window
@@ -696,10 +1250,30 @@ class MainJupiterWindow(Window):
             px + cursor, 0,
             px + cursor, self.height
         ]
-        for i in self.sounds:
-            i.update_component()
+        self.update_viewport()
         self.bpm_grid.start_px = self.start_line_left_padding
-        self.bpm_grid.draw()
+        self.redraw_scheduler.request(self.bpm_grid.draw)
+
+    def update_viewport(self):
+        u"""Show and update only the fragments inside the window.
+
+        The timeline index gives the fragments in the visible time, so
+        the ones far away don't cost anything when panning or zooming.
+        """
+        first = -self.start_line_left_padding / float(self.sec_px)
+        last = (self.width - self.start_line_left_padding) / float(self.sec_px)
+        visible = set(
+            fragment for fragment in self.timeline.overlapping(first, last)
+            if fragment.intersects_rows(0, self.height)
+        )
+        for fragment in self.visible_sounds - visible:
+            fragment.set_in_viewport(False)
+        for fragment in visible:
+            if fragment.in_viewport:
+                fragment.update_component()
+            else:
+                fragment.set_in_viewport(True)
+        self.visible_sounds = visible
 
     def set_cursor_position(self, event):
         x = event.x
@@ -721,7 +1295,10 @@ class MainJupiterWindow(Window):
             track_label=s_fragment.track_label.text
         ).result
         if name:
-            s_fragment.track_label.text = name
+            self.do(SetAttributes([(
+                s_fragment.track_label, 'text',
+                s_fragment.track_label.text, name
+            )]))
 
     def change_bpm(self, event=None):
         bpm = ChangeBPMDialog(
@@ -730,7 +1307,30 @@ class MainJupiterWindow(Window):
             bpm=self.bpm
         ).result
         if bpm:
-            self.bpm = int(bpm)
+            self.do(SetAttributes([(self, 'bpm', self.bpm, int(bpm))]))
+
+    def change_clip_gain(self, event=None):
+        selected = self.get_selected_sound_fragments()
+        if not selected:
+            return
+        gain_db = ClipGainDialog(
+            self,
+            u'Change gain',
+            gain_db=selected[0].edit.gain_db
+        ).result
+        if not gain_db:
+            return
+        try:
+            gain_db = float(gain_db)
+        except ValueError:
+            self.set_status(u'Invalid gain: {}'.format(gain_db))
+            return
+        changes = []
+        for fragment in selected:
+            edit = fragment.edit.copy()
+            edit.gain_db = gain_db
+            changes.append((fragment, 'edit', fragment.edit, edit))
+        self.do(SetAttributes(changes))
 
     def select_all_sound_fragments(self, event=None):
         if len(self.get_selected_sound_fragments()) == len(self.sounds):
@@ -740,34 +1340,300 @@ class MainJupiterWindow(Window):
                 sound.selected = True
 
     def offset_positive_y_sound_fragments(self, event=None):
-        for sound in self.get_selected_sound_fragments():
-            sound.y -= 5
-            sound.update_component()
+        self.do(SetAttributes([
+            (sound, 'y', sound.y, sound.y - 5)
+            for sound in self.get_selected_sound_fragments()
+        ]))
 
     def offset_negative_y_sound_fragments(self, event=None):
+        self.do(SetAttributes([
+            (sound, 'y', sound.y, sound.y + 5)
+            for sound in self.get_selected_sound_fragments()
+        ]))
+
+    def change_volume(self, step):
+        self.do(SetAttributes([
+            (sound, 'volume', sound.volume,
+             max(0.0, round(sound.volume + step, 2)))
+            for sound in self.get_selected_sound_fragments()
+        ]))
+
+    def increase_volume(self, event=None):
+        self.change_volume(VOLUME_STEP)
+
+    def decrease_volume(self, event=None):
+        self.change_volume(-VOLUME_STEP)
+
+    def get_selected_patterns(self):
+        patterns = collections.OrderedDict()
         for sound in self.get_selected_sound_fragments():
-            sound.y += 5
-            sound.update_component()
+            if isinstance(sound.sound, Pattern):
+                patterns[id(sound.sound)] = sound.sound
+        return list(patterns.values())
+
+    def change_pattern_volume(self, step):
+        u"""Change the volume of patterns, heard in all of their instances."""
+        self.do(SetAttributes([
+            (pattern, 'volume', pattern.volume,
+             max(0.0, round(pattern.volume + step, 2)))
+            for pattern in self.get_selected_patterns()
+        ]))
+
+    def increase_pattern_volume(self, event=None):
+        self.change_pattern_volume(VOLUME_STEP)
+
+    def decrease_pattern_volume(self, event=None):
+        self.change_pattern_volume(-VOLUME_STEP)
+
+    def group_fragments(self, event=None):
+        u"""Replace the selected fragments by an instance of a new pattern."""
+        selected = self.get_selected_sound_fragments()
+        if not selected:
+            return
+        if any(isinstance(f.sound, SoundPlaceholder) for f in selected):
+            self.set_status(u'Wait the sounds to load to make a pattern')
+            return
+        first = min(f.start for f in selected)
+        clips = []
+        for fragment in selected:
+            if fragment.sound.key is not None:
+                # the pattern keeps the sound after the fragment is deleted
+                POOL.retain(fragment.sound)
+            clips.append(Clip(
+                fragment.sound, fragment.start - first, fragment.volume,
+                fragment.mute, fragment.solo, fragment.edit.copy()
+            ))
+        pattern = Pattern(
+            clips, SESSION_RATE, SESSION_CHANNELS,
+            length=max(f.end for f in selected) - first
+        )
+        pattern.acquire()
+        instance = SoundFragment(
+            self, pattern, first, min(f.y for f in selected),
+            fill=selected[0].fill,
+            track_label=u'PATTERN'
+        )
+        self.add_fragment(instance)
+        self.do(Batch([
+            RemoveFragments(self, selected),
+            AddFragments(self, [instance]),
+        ]))
+        self.desselect_sound_fragments()
+        instance.selected = True
+
+    def clone_fragments(self, event=None):
+        u"""Copy the selected fragments right after them.
+
+        The copies of pattern instances are instances of the same pattern,
+        so they stay linked.
+        """
+        selected = self.get_selected_sound_fragments()
+        if not selected:
+            return
+        offset = max(f.end for f in selected) - min(f.start for f in selected)
+        clones = [f.copy(f.start + offset) for f in selected]
+        for clone in clones:
+            self.add_fragment(clone)
+            if isinstance(clone.sound, SoundPlaceholder):
+                # the original gets the sound when it is loaded, the
+                # clone must load it too
+                self.load_sound(clone, clone.sound.path)
+        self.do(AddFragments(self, clones))
+        # cloned again by the next ctrl+d, to fill the timeline quickly
+        self.desselect_sound_fragments()
+        for clone in clones:
+            clone.selected = True
+        self.update_viewport()
+
+    def pattern_changed(self, pattern):
+        u"""Show the new render of `pattern` in all of its instances.
+
+        The instances of patterns with `pattern` inside are shown again
+        too, they were rendered again with it.
+        """
+        changed = set([pattern] + pattern.ancestors())
+        for fragment in self.sounds:
+            if fragment.sound in changed:
+                # the duration can change
+                fragment.reindex()
+                fragment.edit_changed()
+
+    def do(self, command):
+        u"""Do `command` and put it in history."""
+        if isinstance(command, SetAttributes) and not command:
+            return
+        self.history.do(command)
+        self.refresh(command)
+
+    def undo(self, event=None):
+        command = self.history.undo()
+        if command is not None:
+            self.refresh(command)
+
+    def redo(self, event=None):
+        command = self.history.redo()
+        if command is not None:
+            self.refresh(command)
+
+    def refresh(self, command):
+        u"""Redraw only the fragments changed by `command`."""
+        for target in command.targets:
+            if isinstance(target, SoundFragment):
+                target.update_component()
+            elif isinstance(target, Pattern):
+                self.pattern_changed(target)
+
+    def add_fragment(self, fragment):
+        self.sounds.append(fragment)
+        # it was created with its items shown, update_viewport hides
+        # it if it is out of window
+        self.visible_sounds.add(fragment)
+
+    def remove_fragment(self, fragment):
+        self.sounds.remove(fragment)
+        self.visible_sounds.discard(fragment)
+        fragment.delete()
+        release_sound(fragment.sound)
+
+    def detach_fragments(self, fragments):
+        u"""Take `fragments` out of the session, keeping them to be undone."""
+        removed = set(fragments)
+        self.sounds[:] = [f for f in self.sounds if f not in removed]
+        for fragment in fragments:
+            fragment.detach()
+            self.visible_sounds.discard(fragment)
+            fragment.set_in_viewport(False)
+
+    def attach_fragments(self, fragments):
+        u"""Bring back fragments taken out by detach_fragments."""
+        for fragment in fragments:
+            self.sounds.append(fragment)
+            fragment.attach()
+        self.update_viewport()
 
     def delete_fragments(self, event=None):
-        for sound in self.get_selected_sound_fragments():
-            self.sounds.remove(sound)
-            sound.delete()
+        selected = self.get_selected_sound_fragments()
+        if selected:
+            self.do(RemoveFragments(self, selected))
 
     def desselect_sound_fragments(self, event=None):
         for sound in self.sounds:
             sound.selected = False
 
+    def toggle_recording(self, event=None):
+        if self.recorder is None:
+            self.start_recording()
+        else:
+            self.stop_recording()
+
+    def start_recording(self):
+        u"""Record in a new fragment at cursor, playing the others."""
+        path = os.path.join(
+            RECORDINGS_DIR, time.strftime(u'recording-%Y%m%d-%H%M%S.wav'))
+        recorder = Recorder(path, SESSION_RATE, RECORD_CHANNELS)
+        try:
+            if not os.path.isdir(RECORDINGS_DIR):
+                os.makedirs(RECORDINGS_DIR)
+            recorder.start()
+        except (IOError, OSError, wave.Error) as e:
+            self.set_status(u'Error recording {}: {}'.format(path, e))
+            return
+        try:
+            self.mixer.backend.start_recording(recorder)
+        except (IOError, OSError, NotImplementedError) as e:
+            recorder.stop()
+            self.set_status(u'Error recording: {}'.format(e))
+            return
+
+        if self.playing:
+            # overdub, where the transport is
+            start = self.mixer.seconds
+        else:
+            dx = self.cursor_line.coords[0] - self.start_line_left_padding
+            start = dx / float(self.sec_px)
+        # muted while recording, to not play the input back late; moved
+        # to where it was really recorded by poll_recording
+        fragment = SoundFragment(
+            self, recorder.sound, start, 100,
+            mute=True,
+            track_label=u'RECORDING'
+        )
+        self.add_fragment(fragment)
+        self.recorder = recorder
+        self.recording_fragment = fragment
+        if not self.playing:
+            self.toggle_play_pause()
+        self.after(RECORD_POLL_MS, self.poll_recording)
+
+    def poll_recording(self):
+        fragment = self.recording_fragment
+        if fragment is None or fragment.deleted:
+            return
+        start = self.recording_start(self.recorder)
+        if start is not None:
+            fragment.start = max(0.0, start)
+        # the same sound, but longer
+        fragment.set_sound(fragment.sound)
+        self.after(RECORD_POLL_MS, self.poll_recording)
+
+    def recording_start(self, recorder):
+        u"""Seconds of timeline where the recording began, None if unknown.
+
+        Known from the first input while playing, so the time between
+        opening the input and starting the transport doesn't matter.
+        """
+        if recorder.start_frame is None:
+            return None
+        return recorder.start_frame / float(recorder.rate)
+
+    def finish_recording(self):
+        u"""Stop the input and write the rest of the recording."""
+        recorder = self.recorder
+        self.recorder = None
+        self.mixer.backend.stop_recording()
+        recorder.stop()
+        return recorder
+
+    def stop_recording(self):
+        recorder = self.finish_recording()
+        fragment = self.recording_fragment
+        self.recording_fragment = None
+        if self.playing:
+            self.toggle_play_pause()
+        if recorder.dropped:
+            self.set_status(u'{} frames of input were lost'.format(
+                recorder.dropped))
+        if fragment.deleted:
+            # deleted while recording, the file is kept anyway
+            return
+        fragment.mute = False
+        # what was played is heard and recorded after the latency, so the
+        # recording starts that much later (without cutting the file)
+        source_in = recorder.latency
+        start = self.recording_start(recorder)
+        if start is not None:
+            if start < 0:
+                # begun before the timeline, that part is trimmed
+                source_in -= start
+                start = 0.0
+            fragment.start = start
+        fragment.edit = Edit(source_in=source_in)
+        if fragment.attached:
+            # else its deletion is in history already, and undoing it
+            # brings the recording back
+            self.history.push(AddFragments(self, [fragment]))
+        # the file, as any other sound, replaces the one in memory
+        self.load_sound(fragment, recorder.path)
+
     def toggle_play_pause(self, event=None):
         if self.playing:
             self.playing = False
-            for sound in self.sounds:
-                sound.stop()
+            self.mixer.stop_all()
         else:
             self.playing = True
             dx = self.cursor_line.coords[0] - self.start_line_left_padding
             self.start_seek = dx / float(self.sec_px)
-            self.start_play = time.time()
+            self.mixer.play_from(self.start_seek)
             self.update_play_line()
 
     def get_selected_sound_fragments(self):
@@ -775,37 +1641,66 @@ class MainJupiterWindow(Window):
 
 
     def update_play_line(self):
-        duration = time.time() - self.start_play
+        u"""Move the play line to where the mixer's transport is.
+
+        The sounds are started by the mixer itself, so this only needs
+        to run at display rate.
+        """
+        began = time.perf_counter()
+        secs_playing = self.mixer.seconds
 
-        x = self.start_line_left_padding + (self.start_seek * self.sec_px)
-        x += self.sec_px * duration
+        x = self.start_line_left_padding + (secs_playing * self.sec_px)
         self.play_line.coords = [
             x, 0, x, self.height
         ]
 
-        secs_playing = self.start_seek + duration
         minutes_playing = int(secs_playing / 60.0)
         secs_playing = secs_playing % 60.0
         self.play_position_label.text = u'{}min {:.2f}secs'.format(
             minutes_playing, secs_playing
         )
+        self.update_meters(self.mixer.read_levels())
 
-        actual_seek = self.start_seek + duration
-        # there is a better way to avoid loop all fragments?
-        for sound in self.sounds:
-            interval = [
-                sound.start,
-                sound.start + sound.sound.duration
-            ]
-            if actual_seek >= interval[0] and actual_seek <= interval[1]:
-                seek_to_play = actual_seek - sound.start
-                if self.playing:
-                    sound.play(seek_to_play)
         if self.playing:
-            self.after(1, self.update_play_line)
+            self.after(PLAY_LINE_INTERVAL_MS, self.update_play_line)
         else:
             self.play_line.coords = [0, 0, 0, 0]
             self.play_position_label.text = '0min 0sec'
+            self.update_meters(Levels())
+
+        profile = self.mixer.profile
+        if profile is not None:
+            profile.record_tick(time.perf_counter() - began)
+            self.profile_label.text = profile.summary()
+
+    def toggle_profiling(self, event=None):
+        u"""Start to measure playback, or stop and write what was measured."""
+        profile = self.mixer.profile
+        if profile is None:
+            self.mixer.profile = PlaybackProfile()
+            self.profile_label.text = self.mixer.profile.summary()
+            return
+        self.mixer.profile = None
+        self.profile_label.text = u''
+        self.dump_profile(profile)
+
+    def dump_profile(self, profile):
+        path = PROFILE_PATH or DEFAULT_PROFILE_PATH
+        try:
+            profile.dump(path)
+        except (IOError, OSError) as e:
+            self.set_status(u'Error writing {}: {}'.format(path, e))
+        else:
+            self.set_status(u'Profile written to {}'.format(path))
+
+    def update_meters(self, levels):
+        u"""Show the `levels` read from the mixer (at display rate)."""
+        for fragment in self.visible_sounds:
+            fragment.set_meter(levels.get(fragment)[0])
+        peak = levels.master[0]
+        self.master_meter.width = meter_fraction(peak) * MASTER_METER_LENGTH
+        self.master_meter_label.text = (
+            u'{:.1f} dB'.format(to_db(peak)) if peak else u'')
 
     @property
     def sec_px(self):
@@ -814,9 +1709,8 @@ class MainJupiterWindow(Window):
     @sec_px.setter
     def sec_px(self, value):
         self.__sec_px = value
-        for sound in self.sounds:
-            threading.Timer(0, sound.calculates_sound_lines).start()
-            sound.update_component()
+        # the sound lines are calculated again when the fragments are updated
+        self.update_viewport()
         self.sec_px_label.text = u'{}px/sec'.format(self.sec_px)
 
     def mouse_scroll_up_handler(self, event=None):
@@ -825,7 +1719,6 @@ class MainJupiterWindow(Window):
         elif self.kmap.get('Control_L'):
             self.sec_px += 1
             self.bpm_grid.sec_px = self.sec_px
-            self.bpm_grid.draw()
 
     def mouse_scroll_down_handler(self, event=None):
         if self.kmap.get(u'Shift_L', False):
@@ -837,7 +1730,6 @@ class MainJupiterWindow(Window):
                 self.sec_px = 5
 
             self.bpm_grid.sec_px = self.sec_px
-            self.bpm_grid.draw()
 
     def show_about(self, event=None):
         JupiterAboutWindow(self)
@@ -856,22 +1748,165 @@ class MainJupiterWindow(Window):
         if not filenames:
             return
 
+        # the fragments appear at once, their sounds come in background
         for filename in filenames:
-            self.set_status(u'Loading {} ...'.format(filename))
+            try:
+                placeholder = SoundPlaceholder.from_file(filename)
+            except LOAD_ERRORS as e:
+                self.set_status(u'Error loading {}: {}'.format(filename, e))
+                continue
             sv = SoundFragment(
                 self,
-                JupiterSound(filename),
+                placeholder,
                 1.0, 100,
                 track_label=os.path.basename(
                     os.path.splitext(filename)[0]).upper()
             )
-            self.sounds.append(sv)
-        self.set_status('')
+            self.add_fragment(sv)
+            self.load_sound(sv, filename)
+        self.update_viewport()
+
+    def load_sound(self, fragment, path):
+        u"""Load `path` in background and then give it to `fragment`."""
+        def loaded(sound, error):
+            if fragment.deleted:
+                # deleted while loading
+                if sound is not None:
+                    POOL.release(sound)
+            elif isinstance(error, LoadCancelled):
+                # only fragments that are nothing without the sound; the
+                # ones in history (clones, recordings) must stay for it,
+                # and a recording keeps the sound recorded in memory
+                if (isinstance(fragment.sound, SoundPlaceholder)
+                        and fragment.attached
+                        and not self.history.refers_to(fragment)):
+                    self.remove_fragment(fragment)
+            elif error is not None:
+                self.set_status(u'Error loading {}: {}'.format(path, error))
+            else:
+                fragment.set_sound(sound)
+
+        self.loader.load(path, loaded)
+        if self.loader.pending == 1:
+            self.after(LOADER_POLL_MS, self.poll_loader)
+
+    def poll_loader(self):
+        self.loader.poll()
+        if self.loader.pending:
+            self.set_status(u'Loading {}/{} sounds (c to cancel)'.format(
+                self.loader.finished + 1,
+                self.loader.finished + self.loader.pending
+            ))
+            self.after(LOADER_POLL_MS, self.poll_loader)
+        elif self.status_text.text.startswith((u'Loading', u'Canceling')):
+            self.set_status('')
+
+    def cancel_loading(self, event=None):
+        if self.loader.pending:
+            self.loader.cancel()
+            self.set_status(u'Canceling...')
+
+    def save_project(self, event=None):
+        path = filedialog.asksaveasfilename(
+            defaultextension=EXTENSION,
+            filetypes=PROJECT_FILETYPES
+        )
+        if not path:
+            return
+        try:
+            save_project(path, Project(
+                self.bpm, self.sec_px, [s.get_state() for s in self.sounds]
+            ))
+        except (IOError, OSError) as e:
+            self.set_status(u'Error saving {}: {}'.format(path, e))
+            return
+        self.set_status(u'Saved {}'.format(path))
+
+    def open_project(self, event=None):
+        u"""Restore the layout at once, the sounds come in background."""
+        path = filedialog.askopenfilename(filetypes=PROJECT_FILETYPES)
+        if not path:
+            return
+        try:
+            project = load_project(path)
+        except (IOError, OSError, ValueError, KeyError, IndexError) as e:
+            self.set_status(u'Error opening {}: {}'.format(path, e))
+            return
+
+        if self.playing:
+            self.toggle_play_pause()
+        self.history.clear()
+        for fragment in list(self.sounds):
+            self.remove_fragment(fragment)
+        self.bpm = project.bpm
+        self.sec_px = project.sec_px
+        self.bpm_grid.sec_px = self.sec_px
+
+        # the patterns are built with placeholders too
+        patterns = collections.OrderedDict()
+        for state in project.fragments:
+            if 'pattern' in state:
+                sound = Pattern.from_state(
+                    state['pattern'], SoundPlaceholder,
+                    SESSION_RATE, SESSION_CHANNELS, patterns
+                )
+            else:
+                sound = SoundPlaceholder(state['path'], state['duration'])
+            fragment = SoundFragment(
+                self,
+                sound,
+                state['start'], state['y'],
+                volume=state['volume'],
+                mute=state['mute'],
+                solo=state['solo'],
+                fill=state['fill'] or COLORS[0],
+                track_label=state['track_label'],
+                edit=Edit.from_dict(state)
+            )
+            self.add_fragment(fragment)
+            if 'pattern' in state:
+                sound.acquire()
+            else:
+                self.load_sound(fragment, state['path'])
+        for pattern in patterns.values():
+            for clip in pattern.clips:
+                if isinstance(clip.sound, SoundPlaceholder):
+                    self.load_clip_sound(clip, pattern)
+        self.update_viewport()
+
+    def load_clip_sound(self, clip, pattern):
+        u"""Load the sound of a clip of `pattern` in background.
+
+        Only `pattern` (and the ones with it inside) is rendered again
+        when it is loaded.
+        """
+        def loaded(sound, error):
+            if isinstance(error, LoadCancelled):
+                return
+            if error is not None:
+                self.set_status(
+                    u'Error loading {}: {}'.format(clip.sound.path, error))
+                return
+            if pattern.users <= 0:
+                # all of its instances were deleted while loading
+                POOL.release(sound)
+                return
+            clip.sound = sound
+            pattern.update()
+            self.pattern_changed(pattern)
+
+        self.loader.load(clip.sound.path, loaded)
+        if self.loader.pending == 1:
+            self.after(LOADER_POLL_MS, self.poll_loader)
 
 if __name__ == '__main__':
     top = MainJupiterWindow()
     top.mainloop()
-    PYAUDIO.terminate()
+    if top.recorder is not None:
+        top.finish_recording()
+    if top.mixer.profile is not None:
+        top.mixer.profile.dump(PROFILE_PATH or DEFAULT_PROFILE_PATH)
+    top.mixer.close()
 
 '''
 # save
@@ -0,0 +1,124 @@
+# coding: utf-8
+
+"""Opt-in measures of playback, to find out why it stutters.
+
+The mixer fills a PlaybackProfile when it has one (`Mixer.profile`), and
+the UI adds the duration of its play line ticks. Comparing the callback
+durations with the UI ticks tells whether the mixer or the Tk loop is the
+bottleneck; underruns with fast callbacks point to the device/driver.
+"""
+
+import bisect
+import json
+import threading
+import time
+
+# upper bounds, in milliseconds, of the buckets of duration histograms
+DURATION_BOUNDS_MS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+# the same for lateness, negative when a start was mixed ahead of time
+LATENESS_BOUNDS_MS = (-32, -8, -2, 0, 2, 8, 32, 128)
+
+
+class Histogram(object):
+    u"""Counts of values (in milliseconds) in buckets limited by `bounds`.
+
+    The last bucket has everything above the last bound.
+    """
+
+    def __init__(self, bounds=DURATION_BOUNDS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        return {
+            'bounds_ms': list(self.bounds),
+            'counts': list(self.counts),
+            'count': self.count,
+            'mean_ms': self.mean,
+            'max_ms': self.max,
+        }
+
+
+class PlaybackProfile(object):
+    u"""What the mixer and the UI measured since it was created.
+
+    `record_*` are called from the audio thread and from the Tk thread,
+    hence the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # time spent mixing each period
+        self.callbacks = Histogram()
+        # periods that took longer to mix than to play
+        self.slow_callbacks = 0
+        # underflows reported by the device
+        self.underruns = 0
+        # actual start of each fragment minus its intended start
+        self.lateness = Histogram(LATENESS_BOUNDS_MS)
+        # duration of each update of the play line
+        self.ui_ticks = Histogram()
+
+    def record_callback(self, seconds, period_seconds):
+        with self.lock:
+            self.callbacks.add(seconds * 1000)
+            if seconds > period_seconds:
+                self.slow_callbacks += 1
+
+    def record_underrun(self):
+        with self.lock:
+            self.underruns += 1
+
+    def record_start(self, lateness):
+        with self.lock:
+            self.lateness.add(lateness * 1000)
+
+    def record_tick(self, seconds):
+        with self.lock:
+            self.ui_ticks.add(seconds * 1000)
+
+    def summary(self):
+        u"""A line to be shown while playing."""
+        def ms(value):
+            return u'-' if value is None else u'{:.1f}'.format(value)
+
+        with self.lock:
+            return (
+                u'mix {}/{}ms  slow {}  underruns {}  late {}/{}ms  '
+                u'ui {}/{}ms'
+            ).format(
+                ms(self.callbacks.mean), ms(self.callbacks.max),
+                self.slow_callbacks, self.underruns,
+                ms(self.lateness.mean), ms(self.lateness.max),
+                ms(self.ui_ticks.mean), ms(self.ui_ticks.max)
+            )
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'seconds': time.time() - self.started,
+                'callbacks': self.callbacks.to_dict(),
+                'slow_callbacks': self.slow_callbacks,
+                'underruns': self.underruns,
+                'lateness': self.lateness.to_dict(),
+                'ui_ticks': self.ui_ticks.to_dict(),
+            }
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
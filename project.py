@@ -0,0 +1,169 @@
+# coding: utf-8
+
+"""Jupiter project files.
+
+A project is a json file like
+
+  {"version": 2, "bpm": 110, "sec_px": 20,
+   "sounds": [{"path": "wavdrumkit/bumbo.wav", "duration": 0.1}],
+   "fragments": [{"sound": 0, "start": 0.5, "y": 100, "volume": 1.0,
+                  "mute": false, "solo": false, "fill": "#00aacc",
+                  "track_label": "BUMBO", "source_in": 0.0,
+                  "source_out": null, "fade_in": 0.0, "fade_out": 0.0,
+                  "fade_curve": "linear", "gain_db": 0.0}]}
+
+Each sound file is listed once, with its duration, so the layout can be
+restored before any audio is read. Sound paths are relative to the
+project file. The edits of a fragment (see engine.Edit) are kept as
+parameters, the sound files are never changed.
+
+Fragments can be instances of a pattern (see engine.Pattern), with
+"pattern" in place of "sound". The patterns are listed once, like the
+sounds:
+
+  "patterns": [{"id": "...", "length": 2.0, "volume": 1.0,
+                "clips": [{"sound": 0, "start": 0.5, "volume": 1.0, ...}]}]
+
+where each clip, like a fragment, has a "sound" or an earlier "pattern".
+In the fragments returned by load_project, "pattern" is the dict of
+Pattern.get_state, the same one for all instances of a pattern.
+"""
+
+import json
+import os
+
+PROJECT_VERSION = 2
+# older versions that are still read
+READABLE_VERSIONS = (1, 2)
+EXTENSION = u'.jupiter'
+
+FRAGMENT_DEFAULTS = {
+    'start': 0.0,
+    'y': 100,
+    'volume': 1.0,
+    'mute': False,
+    'solo': False,
+    'fill': None,
+    'track_label': u'',
+    'source_in': 0.0,
+    'source_out': None,
+    'fade_in': 0.0,
+    'fade_out': 0.0,
+    'fade_curve': 'linear',
+    'gain_db': 0.0,
+}
+
+CLIP_DEFAULTS = dict(
+    (key, FRAGMENT_DEFAULTS[key])
+    for key in (
+        'start', 'volume', 'mute', 'solo', 'source_in', 'source_out',
+        'fade_in', 'fade_out', 'fade_curve', 'gain_db',
+    )
+)
+
+
+class Project(object):
+    u"""What is saved of a session.
+
+    `fragments` are dicts with the keys of FRAGMENT_DEFAULTS plus `path`
+    and `duration` of its sound, or `pattern` (see Pattern.get_state).
+    """
+
+    def __init__(self, bpm=110, sec_px=20, fragments=None):
+        self.bpm = bpm
+        self.sec_px = sec_px
+        self.fragments = fragments or []
+
+
+def save_project(path, project):
+    base = os.path.dirname(os.path.abspath(path))
+    sounds = []
+    sound_indexes = {}
+    patterns = []
+    pattern_indexes = {}
+
+    def source(item):
+        u"""The "sound" or "pattern" entry of a fragment or clip."""
+        if 'pattern' in item:
+            return {'pattern': pattern_index(item['pattern'])}
+        sound_path = os.path.abspath(item['path'])
+        if sound_path not in sound_indexes:
+            sound_indexes[sound_path] = len(sounds)
+            sounds.append({
+                'path': os.path.relpath(sound_path, base),
+                'duration': item['duration'],
+            })
+        return {'sound': sound_indexes[sound_path]}
+
+    def pattern_index(pattern):
+        if pattern['id'] not in pattern_indexes:
+            clips = []
+            for clip in pattern['clips']:
+                entry = source(clip)
+                for key, default in CLIP_DEFAULTS.items():
+                    entry[key] = clip.get(key, default)
+                clips.append(entry)
+            # added after the patterns it has, so these are read first
+            pattern_indexes[pattern['id']] = len(patterns)
+            patterns.append({
+                'id': pattern['id'],
+                'length': pattern.get('length'),
+                'volume': pattern.get('volume', 1.0),
+                'clips': clips,
+            })
+        return pattern_indexes[pattern['id']]
+
+    fragments = []
+    for fragment in project.fragments:
+        entry = source(fragment)
+        for key, default in FRAGMENT_DEFAULTS.items():
+            entry[key] = fragment.get(key, default)
+        fragments.append(entry)
+
+    with open(path, 'w') as f:
+        json.dump({
+            'version': PROJECT_VERSION,
+            'bpm': project.bpm,
+            'sec_px': project.sec_px,
+            'sounds': sounds,
+            'patterns': patterns,
+            'fragments': fragments,
+        }, f, separators=(',', ':'))
+
+
+def load_project(path):
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('version') not in READABLE_VERSIONS:
+        raise ValueError(u'{} is not a Jupiter project'.format(path))
+
+    base = os.path.dirname(os.path.abspath(path))
+    sounds = [
+        (os.path.normpath(os.path.join(base, s['path'])), s['duration'])
+        for s in data['sounds']
+    ]
+    patterns = []
+
+    def resolve(item):
+        u"""Replace the "sound" or "pattern" index of `item` in place."""
+        if 'pattern' in item:
+            item['pattern'] = patterns[item['pattern']]
+        else:
+            item['path'], item['duration'] = sounds[item.pop('sound')]
+
+    for entry in data.get('patterns', []):
+        clips = []
+        for clip_entry in entry['clips']:
+            clip = dict(CLIP_DEFAULTS)
+            clip.update(clip_entry)
+            resolve(clip)
+            clips.append(clip)
+        patterns.append(dict(entry, clips=clips))
+
+    fragments = []
+    for entry in data['fragments']:
+        fragment = dict(FRAGMENT_DEFAULTS)
+        fragment.update(entry)
+        resolve(fragment)
+        fragments.append(fragment)
+    return Project(data['bpm'], data['sec_px'], fragments)
@@ -0,0 +1,233 @@
+# coding: utf-8
+
+"""Recording of the audio input into WAV files.
+
+The audio thread only copies each input block into a RingBuffer; a
+writer thread takes the blocks from there, writes them to disk and
+appends them to a RecordingSound, whose peaks grow as it is recorded.
+So the audio thread never waits for the disk, nor for a lock.
+"""
+
+import threading
+import time
+import wave
+
+import numpy
+
+from sound import PEAK_BIN_SIZES, Peaks
+
+# seconds of input the ring holds while the writer is busy
+RING_SECONDS = 10
+# how often the writer looks for new input
+WRITER_INTERVAL_SECONDS = 0.02
+
+
+class RingBuffer(object):
+    u"""Frames passed from one writer thread to one reader thread.
+
+    No locks: each side only changes its own counter, and only after
+    copying the frames, so the other side never sees half a block.
+    """
+
+    def __init__(self, frames, channels, dtype=numpy.int16):
+        self.buffer = numpy.zeros((frames, channels), dtype)
+        # frames written and read since the beginning
+        self.written = 0
+        self.read_count = 0
+
+    @property
+    def capacity(self):
+        return len(self.buffer)
+
+    def __len__(self):
+        return self.written - self.read_count
+
+    def write(self, block):
+        u"""Copy `block` in, or return False if there is no room for it."""
+        count = len(block)
+        if count > self.capacity - len(self):
+            return False
+        start = self.written % self.capacity
+        first = min(count, self.capacity - start)
+        self.buffer[start:start + first] = block[:first]
+        self.buffer[:count - first] = block[first:]
+        self.written += count
+        return True
+
+    def read(self):
+        u"""A copy of all frames written and not read yet, None if none."""
+        count = len(self)
+        if not count:
+            return None
+        start = self.read_count % self.capacity
+        first = min(count, self.capacity - start)
+        block = numpy.concatenate([
+            self.buffer[start:start + first], self.buffer[:count - first]
+        ])
+        self.read_count += count
+        return block
+
+
+class GrowingPeaks(object):
+    u"""Waveform peaks of a sound that is still being recorded.
+
+    Only the frames added are reduced to bins; the frames that don't
+    fill a bin yet are kept for the next add.
+    """
+
+    def __init__(self, channels, max_value, bin_sizes=PEAK_BIN_SIZES):
+        self.bin_sizes = bin_sizes
+        self.max_value = max_value
+        # (min, max) of the full bins of first size, grown by doubling
+        self.bins = numpy.zeros((1024, 2), numpy.float32)
+        self.count = 0
+        self.partial = numpy.zeros((0, channels), numpy.int16)
+
+    def add(self, frames):
+        frames = numpy.concatenate([self.partial, frames])
+        size = self.bin_sizes[0]
+        full = (len(frames) // size) * size
+        self.partial = frames[full:]
+        if full:
+            new = Peaks.from_frames(
+                frames[:full], self.max_value, self.bin_sizes[:1]
+            ).levels[size]
+            if self.count + len(new) > len(self.bins):
+                bins = numpy.zeros(
+                    (max(2 * len(self.bins), self.count + len(new)), 2),
+                    numpy.float32)
+                bins[:self.count] = self.bins[:self.count]
+                self.bins = bins
+            self.bins[self.count:self.count + len(new)] = new
+            self.count += len(new)
+
+    @property
+    def peaks(self):
+        u"""Peaks of what was added until now."""
+        bins = self.bins[:self.count]
+        if len(self.partial):
+            last = Peaks.from_frames(
+                self.partial, self.max_value, self.bin_sizes[:1])
+            bins = numpy.concatenate([bins, last.levels[self.bin_sizes[0]]])
+        length = self.count * self.bin_sizes[0] + len(self.partial)
+        return Peaks.from_bins(bins, length, self.bin_sizes)
+
+
+class RecordingSound(object):
+    u"""The sound being recorded, usable as any sound meanwhile.
+
+    The writer thread appends the frames; `data` is replaced (never
+    changed) on each append, so readers always see a consistent one.
+    """
+
+    key = None
+    mapped = False
+    max_value = numpy.iinfo(numpy.int16).max
+
+    def __init__(self, path, framerate, channels):
+        self.path = path
+        self.framerate = framerate
+        self.channels = channels
+        self._buffer = numpy.zeros((framerate, channels), numpy.int16)
+        self.data = self._buffer[:0]
+        self._peaks = GrowingPeaks(channels, self.max_value)
+
+    @property
+    def frames(self):
+        return self.data
+
+    @property
+    def duration(self):
+        return len(self.data) / float(self.framerate)
+
+    @property
+    def nbytes(self):
+        return self._buffer.nbytes
+
+    @property
+    def peaks(self):
+        return self._peaks.peaks
+
+    def append(self, frames):
+        length = len(self.data)
+        if length + len(frames) > len(self._buffer):
+            # a new buffer, the old one can still be in use by the mixer
+            buffer = numpy.zeros(
+                (max(2 * len(self._buffer), length + len(frames)),
+                 self.channels),
+                numpy.int16)
+            buffer[:length] = self.data
+            self._buffer = buffer
+        self._buffer[length:length + len(frames)] = frames
+        self._peaks.add(frames)
+        self.data = self._buffer[:length + len(frames)]
+
+
+class Recorder(object):
+    u"""Record the input given to `push` into the WAV file `path`.
+
+    `push` is called by the audio thread (see Backend.start_recording),
+    everything else by the thread that owns the recorder.
+    """
+
+    def __init__(self, path, rate=44100, channels=1,
+                 ring_seconds=RING_SECONDS):
+        self.path = path
+        self.rate = rate
+        self.channels = channels
+        self.sound = RecordingSound(path, rate, channels)
+        self.ring = RingBuffer(int(rate * ring_seconds), channels)
+        # input frames lost because the ring was full
+        self.dropped = 0
+        # seconds between a sound being played and being recorded, given
+        # by the backend
+        self.latency = 0.0
+        # frame of timeline (see Mixer.frame) where the first frame of
+        # recording was played, known at the first push while playing
+        self.start_frame = None
+        self.running = False
+        self.thread = None
+        self.output = None
+
+    def push(self, block, frame=None):
+        u"""Take a (frames, channels) int16 block of input; never blocks.
+
+        `frame` is the frame of timeline being mixed when the block came,
+        None while the transport is stopped.
+        """
+        if not self.ring.write(block):
+            self.dropped += len(block)
+        if self.start_frame is None and frame is not None:
+            # the block was recorded in the frames before `frame`, and
+            # the ones written before it in the frames before the block
+            self.start_frame = frame - self.ring.written
+
+    def start(self):
+        self.output = wave.open(self.path, u'wb')
+        self.output.setnchannels(self.channels)
+        self.output.setsampwidth(2)
+        self.output.setframerate(self.rate)
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        u"""Write what is left in the ring and close the file."""
+        self.running = False
+        self.thread.join()
+        self.output.close()
+
+    def run(self):
+        while True:
+            # checked before reading the ring, so what was pushed before
+            # stop is still written
+            running = self.running
+            block = self.ring.read()
+            if block is not None:
+                self.output.writeframes(block.tobytes())
+                self.sound.append(block)
+            elif not running:
+                return
+            else:
+                time.sleep(WRITER_INTERVAL_SECONDS)
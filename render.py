@@ -0,0 +1,123 @@
+# coding: utf-8
+
+"""Offline mixdown of Jupiter fragments to a WAV file.
+
+Usage:
+  python render.py fragments.json output.wav [--rate 44100] [--channels 2]
+                                             [--quality best]
+
+where fragments.json is a Jupiter project file or a list of objects like
+  {"path": "wavdrumkit/bumbo.wav", "start": 0.5, "volume": 1.0,
+   "mute": false, "solo": false, "source_in": 0.0, "source_out": null,
+   "fade_in": 0.0, "fade_out": 0.0, "fade_curve": "linear", "gain_db": 0.0}
+Project files can also have patterns (see engine.Pattern). Relative
+paths are resolved from the directory of the json file. Sounds
+in other formats are converted to the rate and channels of the output.
+"""
+
+import argparse
+import json
+import os
+import wave
+
+import numpy
+
+from engine import (
+    Clip, Edit, Pattern, audible_clips, fragments_index, mix_block, to_int16
+)
+from project import load_project
+from sound import (
+    POOL, RESAMPLE_QUALITIES, RESAMPLE_QUALITY, SESSION_CHANNELS,
+    SESSION_RATE, SamplePool
+)
+
+BLOCK_SIZE = 65536
+
+
+def render(clips, path, rate=44100, channels=2, block_size=BLOCK_SIZE):
+    u"""Mix `clips` faster than real time into the WAV file `path`.
+
+    Returns the number of frames written.
+    """
+    clips = audible_clips(clips)
+    index = fragments_index(clips)
+    total = max([
+        int(round(c.start * rate)) + len(c.frames) for c in clips
+    ] or [0])
+
+    buffer = numpy.zeros((block_size, channels), numpy.float32)
+    scratch = numpy.zeros_like(buffer)
+    output = wave.open(path, u'wb')
+    output.setnchannels(channels)
+    output.setsampwidth(2)
+    output.setframerate(rate)
+    try:
+        for block_start in range(0, total, block_size):
+            block_end = min(block_start + block_size, total)
+            block = buffer[:block_end - block_start]
+            block.fill(0)
+            mix_block(block, block_start, index, rate, scratch)
+            output.writeframes(to_int16(block).tobytes())
+    finally:
+        output.close()
+    return total
+
+
+def load_clips(path, pool=POOL):
+    u"""Read the clips described in the json file `path` from `pool`.
+
+    Patterns are rendered in the rate and channels of `pool`.
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        # a project, its paths are already resolved by load_project
+        entries = load_project(path).fragments
+    base = os.path.dirname(os.path.abspath(path))
+
+    def load_sound(sound_path, duration):
+        return pool.acquire(os.path.join(base, sound_path))
+
+    patterns = {}
+    clips = []
+    for entry in entries:
+        if 'pattern' in entry:
+            sound = Pattern.from_state(
+                entry['pattern'], load_sound,
+                rate=pool.rate or SESSION_RATE,
+                channels=pool.channels or SESSION_CHANNELS,
+                patterns=patterns
+            )
+        else:
+            sound = load_sound(entry['path'], entry.get('duration'))
+        clips.append(Clip(
+            sound,
+            start=entry.get('start', 0.0),
+            volume=entry.get('volume', 1.0),
+            mute=entry.get('mute', False),
+            solo=entry.get('solo', False),
+            edit=Edit.from_dict(entry)
+        ))
+    return clips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=u'Render to a WAV file.')
+    parser.add_argument('fragments', help=u'json file with the fragments')
+    parser.add_argument('output', help=u'WAV file to write')
+    parser.add_argument('--rate', type=int, default=SESSION_RATE)
+    parser.add_argument('--channels', type=int, default=SESSION_CHANNELS)
+    parser.add_argument(
+        '--quality', choices=RESAMPLE_QUALITIES, default=RESAMPLE_QUALITY,
+        help=u'how to resample sounds in other rates')
+    args = parser.parse_args()
+    pool = SamplePool(
+        rate=args.rate, channels=args.channels, quality=args.quality)
+    render(
+        load_clips(args.fragments, pool), args.output,
+        rate=args.rate, channels=args.channels
+    )
+
+
+if __name__ == '__main__':
+    main()
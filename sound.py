@@ -0,0 +1,677 @@
+# coding: utf-8
+
+"""Loading of the sound files used by Jupiter."""
+
+import collections
+import hashlib
+import math
+import multiprocessing
+import os
+import struct
+import tempfile
+import threading
+import wave
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy
+
+# files from this size on are memory mapped instead of read to memory
+MAP_MIN_BYTES = 64 * 1024 * 1024
+# the sample widths that can be used straight from the file
+MAPPED_DTYPES = {2: '<i2', 4: '<i4'}
+# samples per bin of each level of waveform peaks, each one multiple of
+# the previous
+PEAK_BIN_SIZES = (256, 1024, 4096)
+# frames read at once when computing peaks, multiple of PEAK_BIN_SIZES[0]
+PEAK_BLOCK_FRAMES = 256 * 4096
+# where computed peaks are kept between sessions, empty to not keep them
+PEAKS_CACHE_DIR = os.environ.get(
+    'JUPITER_PEAKS_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'jupiter', 'peaks')
+)
+# sounds converted to the session format, kept to not convert them again
+CONVERTED_CACHE_DIR = os.environ.get(
+    'JUPITER_CONVERTED_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'jupiter', 'converted')
+)
+# the format every sound is converted to when imported
+SESSION_RATE = 44100
+SESSION_CHANNELS = 2
+# 'fast' resamples by linear interpolation, 'best' with windowed sinc
+RESAMPLE_QUALITIES = ('fast', 'best')
+RESAMPLE_QUALITY = os.environ.get('JUPITER_RESAMPLE_QUALITY', 'best')
+# zero crossings of each side of the sinc used by 'best'
+SINC_ZERO_CROSSINGS = 16
+# frames resampled at once, to bound the memory used by the sinc taps
+RESAMPLE_BLOCK_FRAMES = 4096
+# threads loading sounds in background
+LOADER_WORKERS = min(4, multiprocessing.cpu_count())
+# peaks file: magic, version, frames of sound and count of levels
+PEAKS_HEADER = struct.Struct('<4sHQI')
+PEAKS_MAGIC = b'JPKS'
+PEAKS_VERSION = 1
+# then for each level: bin size and count of bins, and after all of
+# that, the (min, max) float32 pairs of each level in the same order
+PEAKS_LEVEL = struct.Struct('<II')
+
+
+def decode_pcm(raw, sample_width, channels):
+    u"""Decode little endian PCM bytes to a (frames, channels) array.
+
+    8 bit samples (unsigned) become int16, 24 bit samples become int32
+    shifted to the full int32 range; 16 and 32 bit ones are used as they
+    are, without copying.
+    """
+    if sample_width == 1:
+        data = numpy.frombuffer(raw, numpy.uint8).astype(numpy.int16)
+        data = (data - 128) << 8
+    elif sample_width == 2:
+        data = numpy.frombuffer(raw, '<i2')
+    elif sample_width == 3:
+        packed = numpy.frombuffer(raw, numpy.uint8).reshape(-1, 3)
+        data = numpy.zeros((len(packed), 4), numpy.uint8)
+        # the lowest byte stays zero, so the sign bit is kept
+        data[:, 1:] = packed
+        data = data.view('<i4').reshape(-1)
+    elif sample_width == 4:
+        data = numpy.frombuffer(raw, '<i4')
+    else:
+        raise ValueError(u'Unsupported sample width: {}'.format(sample_width))
+    return data.reshape(-1, channels)
+
+
+def mix_channels(frames, channels):
+    u"""Up/downmix float `frames` to `channels`, the way the mixer does.
+
+    Mono is copied to every channel, anything else is downmixed to mono
+    first.
+    """
+    if frames.shape[1] == channels:
+        return frames
+    if frames.shape[1] != 1:
+        frames = frames.mean(axis=1, keepdims=True, dtype=numpy.float32)
+    return numpy.repeat(frames, channels, axis=1)
+
+
+def resampled_blocks(frames, rate, new_rate, quality=RESAMPLE_QUALITY,
+                     channels=None):
+    u"""Yield (frames, channels) resampled from `rate` to `new_rate`.
+
+    The float32 blocks have RESAMPLE_BLOCK_FRAMES frames (but the last)
+    and each one only reads the source frames around it, so `frames` can
+    be a mapped file of any size. Given `channels`, the source is mixed
+    to them before being resampled.
+    """
+    if quality not in RESAMPLE_QUALITIES:
+        raise ValueError(u'Unknown resample quality: {}'.format(quality))
+    length = int(round(len(frames) * new_rate / float(rate)))
+    step = rate / float(new_rate)
+    # lowpass below the new nyquist when downsampling
+    cutoff = min(1.0, new_rate / float(rate))
+    half_width = int(math.ceil(SINC_ZERO_CROSSINGS / cutoff))
+    offsets = numpy.arange(1 - half_width, half_width + 1)
+    if quality == 'fast':
+        # interpolation only needs the frames at each side
+        half_width = 1
+    for first in range(0, length, RESAMPLE_BLOCK_FRAMES):
+        # positions in the source frames of this block of output
+        times = numpy.arange(
+            first, min(first + RESAMPLE_BLOCK_FRAMES, length)) * step
+        lo = max(0, int(times[0]) + 1 - half_width)
+        hi = min(len(frames), int(math.ceil(times[-1])) + half_width + 1)
+        window = frames[lo:hi].astype(numpy.float32)
+        window = mix_channels(window, channels or window.shape[1])
+        if quality == 'fast':
+            source = numpy.arange(lo, hi)
+            yield numpy.column_stack([
+                numpy.interp(times, source, window[:, channel], right=0)
+                for channel in range(window.shape[1])
+            ]).astype(numpy.float32)
+            continue
+        index = numpy.floor(times).astype(numpy.int64)[:, None] + offsets
+        distance = (times[:, None] - index).astype(numpy.float32)
+        weights = cutoff * numpy.sinc(cutoff * distance)
+        # hann window
+        weights *= 0.5 + 0.5 * numpy.cos(numpy.pi * distance / half_width)
+        # samples out of the sound are silence
+        weights[(index < 0) | (index >= len(frames))] = 0
+        taps = window[numpy.clip(index - lo, 0, len(window) - 1)]
+        yield numpy.einsum('nk,nkc->nc', weights, taps)
+
+
+def converted_blocks(frames, rate, channels, new_rate, new_channels,
+                     quality=RESAMPLE_QUALITY):
+    u"""Yield `frames` in another rate and count of channels, by blocks.
+
+    The blocks have the dtype of `frames`; only one of them is in memory
+    at a time (see resampled_blocks).
+    """
+    if new_rate != rate:
+        # fewer channels are resampled faster, so downmix before and
+        # upmix after
+        blocks = resampled_blocks(
+            frames, rate, new_rate, quality, min(channels, new_channels))
+    else:
+        blocks = (
+            frames[i:i + RESAMPLE_BLOCK_FRAMES].astype(numpy.float32)
+            for i in range(0, len(frames), RESAMPLE_BLOCK_FRAMES)
+        )
+    limits = numpy.iinfo(frames.dtype)
+    for block in blocks:
+        block = numpy.round(mix_channels(block, new_channels))
+        numpy.clip(block, limits.min, limits.max, out=block)
+        yield block.astype(frames.dtype)
+
+
+def find_data_chunk(path):
+    u"""Return (offset, size) in bytes of the PCM data of a WAV file."""
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(u'{} is not a WAV file'.format(path))
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(u'{} has no data chunk'.format(path))
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'data':
+                return f.tell(), size
+            # chunks are word aligned
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+# what can go wrong reading a sound file
+LOAD_ERRORS = (IOError, OSError, EOFError, ValueError, wave.Error)
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+def file_key(path):
+    u"""Identify a file; the same file edited on disk gives another key."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return path, stat.st_mtime, stat.st_size
+
+
+def sound_key(path, rate=None, channels=None, quality=RESAMPLE_QUALITY):
+    u"""Identify a file read in some format (None keeps the file's one)."""
+    return file_key(path) + (rate, channels, quality)
+
+
+def reduce_peaks(peaks, starts):
+    u"""Join the (min, max) rows of `peaks` in groups beginning at `starts`."""
+    return numpy.column_stack([
+        numpy.minimum.reduceat(peaks[:, 0], starts),
+        numpy.maximum.reduceat(peaks[:, 1], starts),
+    ])
+
+
+class Peaks(object):
+    u"""Min/max pyramid of the samples of a sound, used to draw it.
+
+    `levels` maps a bin size (in frames) to a (bins, 2) float32 array with
+    the (min, max) of each bin, from -1 to 1 and of all channels together.
+    """
+
+    def __init__(self, levels, length):
+        self.levels = levels
+        # how many frames the sound has
+        self.length = length
+
+    @classmethod
+    def from_frames(cls, frames, max_value, bin_sizes=PEAK_BIN_SIZES):
+        first = bin_sizes[0]
+        parts = []
+        # by blocks, to not load whole mapped files in memory
+        for i in range(0, len(frames), PEAK_BLOCK_FRAMES):
+            block = frames[i:i + PEAK_BLOCK_FRAMES]
+            starts = numpy.arange(0, len(block), first)
+            parts.append(numpy.column_stack([
+                numpy.minimum.reduceat(block.min(axis=1), starts),
+                numpy.maximum.reduceat(block.max(axis=1), starts),
+            ]))
+        if parts:
+            peaks = numpy.concatenate(parts).astype(numpy.float32)
+            peaks /= max_value
+        else:
+            peaks = numpy.zeros((0, 2), numpy.float32)
+        return cls.from_bins(peaks, len(frames), bin_sizes)
+
+    @classmethod
+    def from_bins(cls, peaks, length, bin_sizes=PEAK_BIN_SIZES):
+        u"""Peaks from the (min, max) bins of the first of `bin_sizes`."""
+        levels = {bin_sizes[0]: peaks}
+        previous = bin_sizes[0]
+        for size in bin_sizes[1:]:
+            if len(peaks):
+                starts = numpy.arange(0, len(peaks), size // previous)
+                peaks = reduce_peaks(peaks, starts)
+            levels[size] = peaks
+            previous = size
+        return cls(levels, length)
+
+    @classmethod
+    def load(cls, path):
+        u"""Read a peaks file, mapping (not reading) the peaks."""
+        with open(path, 'rb') as f:
+            magic, version, length, count = PEAKS_HEADER.unpack(
+                f.read(PEAKS_HEADER.size))
+            if magic != PEAKS_MAGIC or version != PEAKS_VERSION:
+                raise ValueError(u'{} is not a peaks file'.format(path))
+            table = [
+                PEAKS_LEVEL.unpack(f.read(PEAKS_LEVEL.size))
+                for _ in range(count)
+            ]
+        rows = sum(bins for _, bins in table)
+        offset = PEAKS_HEADER.size + (PEAKS_LEVEL.size * count)
+        if rows:
+            data = numpy.memmap(
+                path, dtype='<f4', mode='r', offset=offset, shape=(rows, 2))
+        else:
+            data = numpy.zeros((0, 2), numpy.float32)
+        levels = {}
+        first = 0
+        for size, bins in table:
+            levels[size] = data[first:first + bins]
+            first += bins
+        return cls(levels, length)
+
+    def save(self, path):
+        sizes = sorted(self.levels)
+        with open(path, 'wb') as f:
+            f.write(PEAKS_HEADER.pack(
+                PEAKS_MAGIC, PEAKS_VERSION, self.length, len(sizes)))
+            for size in sizes:
+                f.write(PEAKS_LEVEL.pack(size, len(self.levels[size])))
+            for size in sizes:
+                f.write(self.levels[size].astype('<f4').tobytes())
+
+    def columns(self, count, first=0, last=None):
+        u"""The (min, max) of each one of `count` equal parts of sound.
+
+        Only the frames from `first` to `last` are shown, if given. Uses
+        the coarsest level that still has a bin for each column.
+        """
+        if last is None:
+            last = self.length
+        frames_per_column = (last - first) / float(max(count, 1))
+        sizes = sorted(self.levels)
+        size = sizes[0]
+        for candidate in sizes:
+            if candidate <= frames_per_column:
+                size = candidate
+        peaks = self.levels[size]
+        # the bins with some of the frames shown (ceil of last)
+        peaks = peaks[first // size:-(-last // size)]
+        if not len(peaks) or count <= 0:
+            return numpy.zeros((max(count, 0), 2), numpy.float32)
+        starts = (numpy.arange(count) * len(peaks)) // count
+        return reduce_peaks(peaks, starts)
+
+
+def cache_path(directory, key, extension):
+    name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(directory, name + extension)
+
+
+def peaks_cache_path(key):
+    return cache_path(PEAKS_CACHE_DIR, key, '.peaks')
+
+
+def converted_cache_path(key):
+    return cache_path(CONVERTED_CACHE_DIR, key, '.wav')
+
+
+def load_cached_peaks(key):
+    u"""Return the Peaks kept for file `key`, or None."""
+    if not PEAKS_CACHE_DIR:
+        return None
+    try:
+        return Peaks.load(peaks_cache_path(key))
+    except (IOError, OSError, ValueError, struct.error):
+        return None
+
+
+def save_cached(directory, path, save):
+    u"""Call `save` with a file to be renamed to `path`, if it can be."""
+    if not directory:
+        return
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # written aside and renamed, so readers never see half a file
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+    except (IOError, OSError):
+        return
+    try:
+        save(temp_path)
+        os.rename(temp_path, path)
+    except (IOError, OSError, wave.Error):
+        os.remove(temp_path)
+
+
+def save_cached_peaks(key, peaks):
+    u"""Keep `peaks` of file `key`, if the cache can be written."""
+    save_cached(PEAKS_CACHE_DIR, peaks_cache_path(key), peaks.save)
+
+
+def write_wav(path, blocks, rate, channels, sample_width):
+    u"""Write int16 or int32 (frames, channels) `blocks` to the WAV `path`."""
+    output = wave.open(path, u'wb')
+    try:
+        output.setnchannels(channels)
+        output.setsampwidth(sample_width)
+        output.setframerate(rate)
+        for block in blocks:
+            data = block.astype(block.dtype.newbyteorder('<'))
+            output.writeframes(data.tobytes())
+    finally:
+        output.close()
+
+
+class JupiterSound(object):
+    u"""The samples of a WAV file.
+
+    With `mapped` the samples are a numpy.memmap over the data chunk of the
+    file, so only the pages actually read are loaded (and the OS is free
+    to drop them). By default only big 16 or 32 bit files are mapped.
+
+    The waveform peaks are read from the cache in PEAKS_CACHE_DIR when
+    they were computed before for this same file.
+
+    Given a `rate` and/or `channels` different of the file's, the samples
+    are converted once and the result is kept in CONVERTED_CACHE_DIR, so
+    the file is converted only the first time it is used.
+    """
+
+    def __init__(self, path, mapped=None, rate=None, channels=None,
+                 quality=RESAMPLE_QUALITY):
+        self.path = path
+        self.key = sound_key(path, rate, channels, quality)
+        self.read(path, mapped)
+        rate = rate or self.framerate
+        channels = channels or self.channels
+        if (rate, channels) != (self.framerate, self.channels):
+            self.convert(rate, channels, quality, mapped)
+        self._peaks = load_cached_peaks(self.key)
+        # the same data is shared by all fragments of this sound
+        self.data.flags.writeable = False
+        # the greatest value of a sample, depends on the sample width
+        self.max_value = numpy.iinfo(self.data.dtype).max
+        self.duration = len(self.data) / float(self.framerate)
+
+    def read(self, path, mapped=None):
+        self.media = wave.open(path, u'rb')
+        try:
+            self.channels = self.media.getnchannels()
+            self.framerate = self.media.getframerate()
+            self.sample_width = self.media.getsampwidth()
+            if mapped is None:
+                mapped = os.path.getsize(path) >= MAP_MIN_BYTES
+            self.mapped = mapped and self.sample_width in MAPPED_DTYPES
+            self.data = (
+                self.map_data(path) if self.mapped else self.get_data())
+        finally:
+            self.media.close()
+
+    def convert(self, rate, channels, quality, mapped=None):
+        u"""Bring the samples to `rate` and `channels`, or read the cached.
+
+        The conversion is streamed to the cache and then read from there
+        as any file, so a mapped file is never converted in memory; only
+        when the cache can't be written it is.
+        """
+        path = converted_cache_path(self.key)
+
+        def blocks():
+            return converted_blocks(
+                self.data, self.framerate, self.channels, rate, channels,
+                quality)
+
+        if CONVERTED_CACHE_DIR and not os.path.exists(path):
+            save_cached(
+                CONVERTED_CACHE_DIR, path,
+                lambda temp_path: write_wav(
+                    temp_path, blocks(), rate, channels,
+                    self.data.dtype.itemsize)
+            )
+        if CONVERTED_CACHE_DIR and os.path.exists(path):
+            try:
+                return self.read(path, mapped)
+            except LOAD_ERRORS:
+                pass
+        data = list(blocks())
+        if data:
+            self.data = numpy.concatenate(data)
+        else:
+            self.data = numpy.zeros((0, channels), self.data.dtype)
+        self.framerate = rate
+        self.channels = channels
+        self.sample_width = self.data.dtype.itemsize
+        self.mapped = False
+
+    @property
+    def frames(self):
+        u"""The samples as a (frames, channels) array."""
+        return self.data
+
+    @property
+    def peaks(self):
+        u"""Waveform Peaks, computed in the first use."""
+        if self._peaks is None:
+            self._peaks = Peaks.from_frames(self.data, self.max_value)
+            save_cached_peaks(self.key, self._peaks)
+        return self._peaks
+
+    @property
+    def nbytes(self):
+        u"""Memory used by the samples, mapped ones are paged by the OS."""
+        return 0 if self.mapped else self.data.nbytes
+
+    def get_data(self):
+        u"""Decode the whole file with a single read."""
+        self.media.rewind()
+        raw = self.media.readframes(self.media.getnframes())
+        return decode_pcm(raw, self.sample_width, self.channels)
+
+    def map_data(self, path=None):
+        u"""Map the data chunk of file without reading it."""
+        path = path or self.path
+        offset, size = find_data_chunk(path)
+        # the size in header can be wrong in files of interrupted recordings
+        size = min(size, os.path.getsize(path) - offset)
+        frames = size // (self.sample_width * self.channels)
+        if frames == 0:
+            self.mapped = False
+            return self.get_data()
+        return numpy.memmap(
+            path, dtype=MAPPED_DTYPES[self.sample_width], mode='r',
+            offset=offset, shape=(frames, self.channels)
+        )
+
+
+class SoundPlaceholder(object):
+    u"""Stands for a sound that is still being loaded.
+
+    It has the duration of the real sound but no samples, so fragments
+    can be placed (and drawn flat) before the file is read.
+    """
+
+    key = None
+    mapped = False
+    nbytes = 0
+
+    @classmethod
+    def from_file(cls, path):
+        u"""Placeholder of a WAV file, reading only its header."""
+        media = wave.open(path, u'rb')
+        try:
+            framerate = media.getframerate()
+            return cls(path, media.getnframes() / float(framerate), framerate)
+        finally:
+            media.close()
+
+    def __init__(self, path, duration, framerate=44100):
+        self.path = path
+        self.duration = duration
+        self.framerate = framerate
+        self.channels = 1
+        self.max_value = numpy.iinfo(numpy.int16).max
+        self.data = numpy.zeros((0, 1), numpy.int16)
+        self.peaks = Peaks(
+            {PEAK_BIN_SIZES[0]: numpy.zeros((0, 2), numpy.float32)}, 0)
+
+    @property
+    def frames(self):
+        return self.data
+
+
+class SamplePool(object):
+    u"""Process wide cache of decoded sounds.
+
+    A file is decoded once and the same (read-only) JupiterSound is given
+    to everyone asking for it. Sounds are counted by `acquire`/`release`
+    and the ones nobody is using are dropped, least recently used first,
+    when the pool grows over `max_megabytes`.
+
+    Sounds are converted to `rate` and `channels` (None keeps the format
+    of each file) with the resample `quality`.
+    """
+
+    def __init__(self, max_megabytes=512, rate=None, channels=None,
+                 quality=RESAMPLE_QUALITY):
+        self.max_bytes = int(max_megabytes * 1024 * 1024)
+        self.rate = rate
+        self.channels = channels
+        self.quality = quality
+        self.lock = threading.Lock()
+        # key -> sound, least recently used first
+        self._sounds = collections.OrderedDict()
+        self._refs = {}
+
+    @property
+    def nbytes(self):
+        return sum(s.nbytes for s in self._sounds.values())
+
+    def acquire(self, path):
+        u"""Return the shared sound of `path`, decoding it if needed."""
+        key = sound_key(path, self.rate, self.channels, self.quality)
+        with self.lock:
+            sound = self._sounds.get(key)
+        if sound is None:
+            # decoded out of lock to not block other threads loading
+            sound = JupiterSound(
+                path, rate=self.rate, channels=self.channels,
+                quality=self.quality
+            )
+        with self.lock:
+            sound = self._sounds.pop(key, sound)
+            self._sounds[key] = sound
+            self._refs[key] = self._refs.get(key, 0) + 1
+            self._evict()
+        return sound
+
+    def retain(self, sound):
+        u"""Count one more user of `sound`, acquired before.
+
+        Unlike acquire, the file isn't looked at again: it can have been
+        changed or removed since it was loaded.
+        """
+        with self.lock:
+            self._refs[sound.key] = self._refs.get(sound.key, 0) + 1
+
+    def release(self, sound):
+        u"""Tell that one of the users of `sound` doesn't need it anymore."""
+        with self.lock:
+            count = self._refs.get(sound.key, 0) - 1
+            if count > 0:
+                self._refs[sound.key] = count
+            else:
+                self._refs.pop(sound.key, None)
+            self._evict()
+
+    def _evict(self):
+        total = self.nbytes
+        for key in list(self._sounds):
+            if total <= self.max_bytes:
+                break
+            if key in self._refs:
+                continue
+            total -= self._sounds.pop(key).nbytes
+
+
+# the pool shared by the whole process, all in the session format
+POOL = SamplePool(rate=SESSION_RATE, channels=SESSION_CHANNELS)
+
+
+class SoundLoader(object):
+    u"""Acquire sounds from a pool, with their peaks, in background.
+
+    Several threads decode at once (reading files and NumPy reductions
+    release the GIL). The results are kept until `poll` is called (from
+    the Tk thread), which calls the callback given to `load` with
+    (sound, error); the loads dropped by `cancel` get a LoadCancelled.
+    """
+
+    def __init__(self, pool=POOL, workers=LOADER_WORKERS):
+        self.pool = pool
+        # loads requested and not yet given to their callbacks
+        self.pending = 0
+        # loads given to their callbacks since pending was zero
+        self.finished = 0
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        for _ in range(workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+
+    def load(self, path, callback):
+        if not self.pending:
+            self.finished = 0
+        self.pending += 1
+        self.requests.put((path, callback))
+
+    def cancel(self):
+        u"""Drop the loads that haven't started yet."""
+        while True:
+            try:
+                path, callback = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            self.results.put((callback, None, LoadCancelled(path)))
+
+    def work(self):
+        while True:
+            path, callback = self.requests.get()
+            sound = None
+            try:
+                sound = self.pool.acquire(path)
+                # computed here to not block who is waiting the sound
+                sound.peaks
+            except Exception as e:
+                # not only LOAD_ERRORS (e.g. MemoryError): a dead worker
+                # would leave the load pending forever
+                if sound is not None:
+                    self.pool.release(sound)
+                self.results.put((callback, None, e))
+            else:
+                self.results.put((callback, sound, None))
+
+    def poll(self):
+        u"""Call the callbacks of loads finished since last poll."""
+        while True:
+            try:
+                callback, sound, error = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.pending -= 1
+            self.finished += 1
+            callback(sound, error)
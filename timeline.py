@@ -0,0 +1,129 @@
+# coding: utf-8
+
+"""Time ordered index of the fragments of a session."""
+
+import bisect
+import math
+import threading
+
+
+def length_class(length):
+    u"""The power of two just above `length`, grouping items by length."""
+    if length <= 0:
+        return 0
+    return math.frexp(length)[1]
+
+
+class IntervalIndex(object):
+    u"""Keep items sorted by start to find them in logarithmic time.
+
+    Each item lives in [start, end). The items are also kept in classes
+    of length (powers of two), so lookups of what is active at some
+    moment only look, in each class, at the items starting at most the
+    class length before it. A long stem among short hits then costs its
+    own class, not a scan of all the hits of its length.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (start, id(item)) sorted, and the items in the same order
+        self._keys = []
+        self._items = []
+        # length class -> (its greatest length, keys, items) as above
+        self._classes = {}
+        # sorted, to know the last end
+        self._ends = []
+        # id(item) -> (start, end)
+        self._spans = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return id(item) in self._spans
+
+    def add(self, item, start, end):
+        with self.lock:
+            self._add(item, start, end)
+
+    def remove(self, item):
+        with self.lock:
+            self._remove(item)
+
+    def move(self, item, start, end):
+        u"""Change (or set, if it is new) the interval of `item`."""
+        with self.lock:
+            if id(item) in self._spans:
+                self._remove(item)
+            self._add(item, start, end)
+
+    def _add(self, item, start, end):
+        key = (start, id(item))
+        index = bisect.bisect(self._keys, key)
+        self._keys.insert(index, key)
+        self._items.insert(index, item)
+        cls = length_class(end - start)
+        if cls not in self._classes:
+            self._classes[cls] = (math.ldexp(1.0, cls), [], [])
+        _, keys, items = self._classes[cls]
+        index = bisect.bisect(keys, key)
+        keys.insert(index, key)
+        items.insert(index, item)
+        bisect.insort(self._ends, end)
+        self._spans[id(item)] = (start, end)
+
+    def _remove(self, item):
+        start, end = self._spans.pop(id(item))
+        key = (start, id(item))
+        index = bisect.bisect_left(self._keys, key)
+        del self._keys[index]
+        del self._items[index]
+        cls = length_class(end - start)
+        _, keys, items = self._classes[cls]
+        index = bisect.bisect_left(keys, key)
+        del keys[index]
+        del items[index]
+        if not keys:
+            del self._classes[cls]
+        del self._ends[bisect.bisect_left(self._ends, end)]
+
+    @property
+    def end(self):
+        u"""The greatest end of all items, or None when empty."""
+        return self._ends[-1] if self._ends else None
+
+    def _range(self, t0, t1):
+        # items with t0 <= start < t1
+        first = bisect.bisect_left(self._keys, (t0, ))
+        last = bisect.bisect_left(self._keys, (t1, ))
+        return first, last
+
+    def starting_in(self, t0, t1):
+        u"""Items with start in [t0, t1)."""
+        with self.lock:
+            first, last = self._range(t0, t1)
+            return self._items[first:last]
+
+    def _ending_after(self, t0, upper):
+        # items with end > t0 and (start, id) < upper, sorted by start
+        spans = self._spans
+        found = []
+        for length, keys, items in self._classes.values():
+            first = bisect.bisect_left(keys, (t0 - length, ))
+            last = bisect.bisect_left(keys, upper, first)
+            found.extend(
+                item for item in items[first:last] if spans[id(item)][1] > t0
+            )
+        if len(self._classes) > 1:
+            found.sort(key=lambda item: (spans[id(item)][0], id(item)))
+        return found
+
+    def overlapping(self, t0, t1):
+        u"""Items sounding somewhere in [t0, t1)."""
+        with self.lock:
+            return self._ending_after(t0, (t1, ))
+
+    def active_at(self, t):
+        u"""Items with start <= t < end."""
+        with self.lock:
+            return self._ending_after(t, (t, float('inf')))